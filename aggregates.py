@@ -0,0 +1,197 @@
+"""Per-user running totals over days for constant-time range queries.
+
+`RollingTotals` keeps prefix sums of water, consumed and burned calories,
+calorie goal and the number of days with stats. A profile builds them on
+first use and then keeps them current from `UserProfile.track`, which the
+storage calls whenever a day's counters change.
+
+Check the stored totals against the raw food and workout logs with
+
+    python aggregates.py check
+"""
+import argparse
+import asyncio
+import math
+import sys
+from array import array
+from datetime import date
+from typing import NamedTuple
+
+METRICS = ("water", "consumed", "burned", "calorie_goal", "days")
+
+
+class Totals(NamedTuple):
+    water: float = 0.0
+    consumed: float = 0.0
+    burned: float = 0.0
+    calorie_goal: float = 0.0
+    days: int = 0
+
+    @property
+    def balance(self):
+        return self.consumed - self.calorie_goal - self.burned
+
+    def average(self, name):
+        """Average of a metric (or "balance") per day with stats."""
+        return getattr(self, name) / self.days if self.days else 0.0
+
+
+def _values(stats):
+    return (stats.logged_water, stats.logged_calories, stats.burned_calories, stats.calorie_goal, 1)
+
+
+class RollingTotals:
+    """Prefix sums over consecutive days starting at `first_day`.
+
+    `_prefix[m][i]` is the sum of metric `m` over the first `i` days, so any
+    range is two lookups. Updating a day shifts the prefixes after it, which
+    is O(1) for the latest day, where almost all updates land.
+    """
+    __slots__ = ("first_day", "_prefix")
+
+    def __init__(self):
+        self.first_day = None
+        self._prefix = None
+
+    @classmethod
+    def from_stats(cls, daily_stats):
+        totals = cls()
+        for stats in sorted(daily_stats, key=lambda stats: stats.date):
+            totals.update(stats)
+        return totals
+
+    def __len__(self):
+        return 0 if self._prefix is None else len(self._prefix[0]) - 1
+
+    def _index(self, day):
+        ordinal = day.toordinal()
+        if self._prefix is None:
+            self.first_day = ordinal
+            self._prefix = [array("d", [0.0]) for _ in METRICS]
+        elif ordinal < self.first_day:
+            shift = self.first_day - ordinal
+            self._prefix = [array("d", [0.0] * shift) + prefix for prefix in self._prefix]
+            self.first_day = ordinal
+
+        index = ordinal - self.first_day
+        missing = index + 1 - len(self)
+        if missing > 0:
+            for prefix in self._prefix:
+                prefix.extend([prefix[-1]] * missing)
+        return index
+
+    def update(self, stats):
+        """Store the current counters of `stats` as its day's values."""
+        index = self._index(date.fromisoformat(stats.date))
+        for prefix, value in zip(self._prefix, _values(stats)):
+            delta = value - (prefix[index + 1] - prefix[index])
+            if delta:
+                for i in range(index + 1, len(prefix)):
+                    prefix[i] += delta
+
+    def _bounds(self, start, end):
+        size = len(self)
+        lo = min(max(start.toordinal() - self.first_day, 0), size)
+        hi = min(max(end.toordinal() - self.first_day + 1, 0), size)
+        return lo, max(lo, hi)
+
+    def range(self, start, end):
+        """Totals over the inclusive date range `start`..`end`."""
+        if self._prefix is None:
+            return Totals()
+        lo, hi = self._bounds(start, end)
+        water, consumed, burned, calorie_goal, days = (prefix[hi] - prefix[lo] for prefix in self._prefix)
+        return Totals(water, consumed, burned, calorie_goal, int(days))
+
+    def day(self, day):
+        return self.range(day, day)
+
+    def streak(self, end):
+        """Number of consecutive days with stats ending at `end`."""
+        if self._prefix is None:
+            return 0
+        days = self._prefix[-1]
+        hi = end.toordinal() - self.first_day + 1
+        if not 0 < hi <= len(self) or days[hi] - days[hi - 1] == 0:
+            return 0
+        # The longest run [hi - k, hi) where every day has stats
+        lo, top = 1, hi
+        while lo < top:
+            k = (lo + top + 1) // 2
+            if days[hi] - days[hi - k] == k:
+                lo = k
+            else:
+                top = k - 1
+        return lo
+
+
+def _close(a, b):
+    return math.isclose(a, b, rel_tol=1e-6, abs_tol=0.01)
+
+
+def check_totals(profile):
+    """Rebuild every day of `profile` from its raw logs and compare.
+
+    Returns a list of human readable problems, empty when the counters and
+    the running totals agree with the logs.
+    """
+    problems = []
+    totals = profile.totals
+    expected = Totals()
+    for key in sorted(profile.daily_stats):
+        stats = profile.daily_stats[key]
+        food = sum(entry.calories for entry in stats.food_log)
+        workouts = sum(entry.calories for entry in stats.workout_log)
+        if not _close(food, stats.logged_calories):
+            problems.append(f"{key}: food log sums to {food:.1f} kcal, counter is {stats.logged_calories:.1f}")
+        if not _close(workouts, stats.burned_calories):
+            problems.append(f"{key}: workout log sums to {workouts:.1f} kcal, counter is {stats.burned_calories:.1f}")
+
+        rebuilt = Totals(stats.logged_water, food, workouts, stats.calorie_goal, 1)
+        actual = totals.day(date.fromisoformat(key))
+        for name, want, got in zip(METRICS, rebuilt, actual):
+            if not _close(want, got):
+                problems.append(f"{key}: running {name} is {got:.1f}, logs give {want:.1f}")
+        expected = Totals(*(a + b for a, b in zip(expected, rebuilt)))
+
+    if profile.daily_stats:
+        days = sorted(profile.daily_stats)
+        actual = totals.range(date.fromisoformat(days[0]), date.fromisoformat(days[-1]))
+        for name, want, got in zip(METRICS, expected, actual):
+            if not _close(want, got):
+                problems.append(f"all days: running {name} is {got:.1f}, logs give {want:.1f}")
+    return problems
+
+
+async def check_storage():
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage()
+    await storage.start()
+    failed = 0
+    try:
+        user_ids = await storage.user_ids()
+        for user_id in user_ids:
+            problems = check_totals(await storage.get_profile(user_id))
+            if problems:
+                failed += 1
+                print(f"user {user_id}:")
+                for problem in problems:
+                    print(f"  {problem}")
+    finally:
+        await storage.close()
+    print(f"checked {len(user_ids)} users, {failed} inconsistent")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Running totals maintenance.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check", help="compare running totals with the raw logs of every user")
+    parser.parse_args()
+
+    sys.exit(1 if asyncio.run(check_storage()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Range queries from running totals vs recomputation from stored days.
+
+    python benchmarks/bench_aggregates.py --years 1 3 10
+
+For each history length, times the totals of the last 30 days and of the
+whole history three ways: the running totals of `aggregates.py`, a plain
+Python rescan of the days and their food and workout logs, and the pandas
+path of `history.aggregate_history`. Also times the incremental update made
+after every logged item.
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aggregates import check_totals  # noqa: E402
+from history import aggregate_history  # noqa: E402
+from models import DailyStats, UserProfile, FoodEntry, WorkoutEntry  # noqa: E402
+
+
+def build_profile(days, today):
+    profile = UserProfile(user_id=1, weight=70, height=180, age=30, activity_minutes=60, city="Moscow")
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        stats = DailyStats(day, 1500 + offset % 500, 0, 0, 3100, 1915, 21)
+        for i in range(4):
+            stats.food_log.append(FoodEntry("banana", 150, 133.5, 0))
+            stats.logged_calories += 133.5
+        stats.workout_log.append(WorkoutEntry("run", 30, 300, 0))
+        stats.burned_calories += 300
+        profile.daily_stats[stats.date] = stats
+    return profile
+
+
+def rescan(profile, start, end):
+    water = consumed = burned = goal = days = 0
+    for key, stats in profile.daily_stats.items():
+        if start.isoformat() <= key <= end.isoformat():
+            water += stats.logged_water
+            consumed += sum(entry.calories for entry in stats.food_log)
+            burned += sum(entry.calories for entry in stats.workout_log)
+            goal += stats.calorie_goal
+            days += 1
+    return water, consumed, burned, goal, days
+
+
+def timeit(func, repeat):
+    func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    today = date(2024, 12, 31)
+    print(f"{'history':>8} {'range':>6} {'running':>10} {'rescan':>10} {'pandas':>10}   (us per call)")
+    for years in args.years:
+        profile = build_profile(years * 365, today)
+        started = time.perf_counter()
+        profile.totals
+        build_ms = (time.perf_counter() - started) * 1000
+        assert not check_totals(profile)
+
+        first = date.fromisoformat(min(profile.daily_stats))
+        for name, start in (("30d", today - timedelta(days=29)), ("all", first)):
+            timings = (
+                timeit(lambda: profile.totals.range(start, today), args.repeat * 100),
+                timeit(lambda: rescan(profile, start, today), args.repeat),
+                timeit(lambda: aggregate_history(profile, start, today), args.repeat),
+            )
+            print(f"{years:>6} y {name:>6} " + " ".join(f"{us:>10.1f}" for us in timings))
+
+        stats = profile.daily_stats[today.isoformat()]
+
+        def log_water():
+            stats.logged_water += 250
+            profile.track(stats)
+
+        print(f"{'':>8} {'':>6} first build {build_ms:.2f} ms, "
+              f"update of today {timeit(log_water, args.repeat * 100):.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Chart render throughput of the worker pool.
+
+    python benchmarks/bench_charts.py --workers 1 2 4 --charts 40 --days 30
+
+For each pool size renders `--charts` distinct charts concurrently through
+`charts.ChartRenderer` and reports charts per second overall and per
+worker, after the pool has been started and warmed. Also times a repeated
+request answered from the content-addressed cache.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from charts import ChartRenderer, chart_data  # noqa: E402
+from models import DailyStats, UserProfile  # noqa: E402
+
+
+def build_profile(user_id, days, today):
+    profile = UserProfile(user_id=user_id, weight=70, height=180, age=30, activity_minutes=60, city="Moscow")
+    for offset in range(days):
+        day = (today - timedelta(days=offset)).isoformat()
+        profile.daily_stats[day] = DailyStats(
+            day, 1000 + (user_id * 37 + offset * 11) % 2500, 1500 + offset % 700, 300, 3100, 1915, 21
+        )
+    return profile
+
+
+async def bench(workers, charts, days):
+    today = date.today()
+    start = today - timedelta(days=days - 1)
+    datasets = [chart_data(build_profile(i, days, today), start, today) for i in range(charts)]
+
+    renderer = ChartRenderer(workers=workers)
+    try:
+        # Start and warm every worker before timing
+        warm = [chart_data(build_profile(charts + i, days, today), start, today) for i in range(workers)]
+        await asyncio.gather(*(renderer.render(data) for data in warm))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(renderer.render(data) for data in datasets))
+        elapsed = time.perf_counter() - started
+
+        cached = time.perf_counter()
+        await renderer.render(datasets[0])
+        cached = time.perf_counter() - cached
+    finally:
+        await renderer.close()
+    return charts / elapsed, cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--charts", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.charts} charts of {args.days} days")
+    print(f"{'workers':>8} {'charts/s':>10} {'per worker':>11} {'cache hit':>10}")
+    for workers in sorted(set(args.workers)):
+        rate, cached = asyncio.run(bench(workers, args.charts, args.days))
+        print(f"{workers:>8} {rate:>10.1f} {rate / workers:>11.1f} {cached * 1e6:>8.0f}us")
+
+
+if __name__ == "__main__":
+    main()
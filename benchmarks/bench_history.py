@@ -0,0 +1,63 @@
+"""Latency of /history aggregation as the stored history grows.
+
+    python benchmarks/bench_history.py --years 1 3 10
+
+For each history length, times `format_history` for a week, a month and a
+full-year custom range. Week and month latency should stay flat as the
+number of stored days grows.
+"""
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from history import format_history, parse_period  # noqa: E402
+from models import DailyStats, UserProfile, FoodEntry  # noqa: E402
+
+
+def build_profile(days, today):
+    profile = UserProfile(user_id=1, weight=70, height=180, age=30, activity_minutes=60, city="Moscow")
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        stats = DailyStats(day, 1500 + offset % 500, 2100, 300, 3100, 1915, 21)
+        stats.food_log.append(FoodEntry("banana", 150, 133.5, 0))
+        profile.daily_stats[stats.date] = stats
+    return profile
+
+
+def timeit(func, repeat):
+    func()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    today = date(2024, 12, 31)
+    periods = {
+        "week": parse_period("week", today),
+        "month": parse_period("month", today),
+        "year": parse_period("2024-01-01 2024-12-31", today),
+    }
+
+    print(f"{'history':>10} " + " ".join(f"{name:>10}" for name in periods) + "   (ms per call)")
+    for years in args.years:
+        profile = build_profile(years * 365, today)
+        timings = [
+            timeit(lambda: format_history(profile, start, end), args.repeat)
+            for start, end in periods.values()
+        ]
+        print(f"{years:>8} y " + " ".join(f"{ms:>10.3f}" for ms in timings))
+
+
+if __name__ == "__main__":
+    main()
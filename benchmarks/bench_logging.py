@@ -0,0 +1,63 @@
+"""Per-message logging overhead on the calling thread.
+
+    python benchmarks/bench_logging.py --messages 20000
+
+Configures the real sinks (stdout replaced by a file, log files in a temp
+dir) in synchronous and queued mode and measures the time spent in the
+`LoggingMiddleware` log call for each message. Messages are spaced by
+`--gap-us` to mimic the event loop waiting on I/O between updates. Mean, p99 and max are
+reported; the tail shows stalls such as file rotation and compression.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from logger import CustomizeLogger, loggeru  # noqa: E402
+
+
+def run(queued, json_format, messages, gap, log_dir):
+    with open(log_dir / "stdout.log", "w") as stream:
+        logger = CustomizeLogger.make_logger("bench", queued=queued, json_format=json_format,
+                                             log_dir=log_dir, stream=stream)
+        timings = []
+        for i in range(messages):
+            started = time.perf_counter()
+            logger.info("Message from user {} with text: {}", i % 1000, "/log_water 250")
+            timings.append(time.perf_counter() - started)
+            if gap:
+                time.sleep(gap)
+        loggeru.remove()
+    timings.sort()
+    return (
+        sum(timings) / messages * 1e6,
+        timings[int(messages * 0.99)] * 1e6,
+        timings[-1] * 1e6,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--gap-us", type=int, default=100, help="pause between messages")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as log_dir:
+        for queued in (False, True):
+            for json_format in (False, True):
+                results[queued, json_format] = run(
+                    queued, json_format, args.messages, args.gap_us / 1e6, Path(log_dir)
+                )
+
+    print(f"{'mode':<8} {'format':<6} {'mean us':>10} {'p99 us':>10} {'max us':>10}")
+    for (queued, json_format), (mean, p99, worst) in results.items():
+        print(f"{'queued' if queued else 'sync':<8} {'json' if json_format else 'text':<6} "
+              f"{mean:>10.1f} {p99:>10.1f} {worst:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Memory-per-user benchmark for the profile and daily stats representation.
+
+    python benchmarks/bench_memory.py --users 2000 --days 90 --budget 60000
+
+Builds synthetic users with a history of `--days` days, each day holding a
+few food and workout entries, and reports traced bytes per user. The same
+history built from plain dicts and ISO timestamp strings is measured as a
+reference. Exits non-zero when the per-user size exceeds `--budget`.
+"""
+import argparse
+import sys
+import tracemalloc
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import DailyStats, UserProfile, FoodEntry, WorkoutEntry  # noqa: E402
+
+FOODS = ["banana", "oatmeal", "coffee", "apple", "bread", "cheese"]
+WORKOUTS = ["run", "walk", "tennis"]
+
+
+def day_range(days):
+    start = date(2024, 1, 1)
+    return [(start + timedelta(days=i)).isoformat() for i in range(days)]
+
+
+def build_compact(users, days, foods_per_day, workouts_per_day):
+    dates = day_range(days)
+    profiles = []
+    for user_id in range(users):
+        profile = UserProfile(user_id=user_id, weight=70, height=180, age=30,
+                              activity_minutes=60, city="Moscow")
+        for day in dates:
+            stats = DailyStats(day, 1500, 2100, 300, 3100, 1915, 21)
+            for i in range(foods_per_day):
+                stats.food_log.append(FoodEntry(FOODS[i % len(FOODS)], 150, 133.5, 1704067200 + i))
+            for i in range(workouts_per_day):
+                stats.workout_log.append(WorkoutEntry(WORKOUTS[i % len(WORKOUTS)], 30, 300, 1704067200 + i))
+            profile.daily_stats[stats.date] = stats
+        profiles.append(profile)
+    return profiles
+
+
+def build_reference(users, days, foods_per_day, workouts_per_day):
+    dates = day_range(days)
+    profiles = []
+    for user_id in range(users):
+        history = {}
+        for day in dates:
+            stats = {
+                "date": day, "logged_water": 1500.0, "logged_calories": 2100.0,
+                "burned_calories": 300.0, "water_goal": 3100.0, "calorie_goal": 1915.0,
+                "temperature": 21.0, "food_log": [], "workout_log": [],
+            }
+            for i in range(foods_per_day):
+                stats["food_log"].append({
+                    "name": "".join(FOODS[i % len(FOODS)]), "weight": 150.0, "calories": 133.5,
+                    "timestamp": datetime(2024, 1, 1, 12, 0, i).isoformat(),
+                })
+            for i in range(workouts_per_day):
+                stats["workout_log"].append({
+                    "type": "".join(WORKOUTS[i % len(WORKOUTS)]), "duration": 30, "calories": 300.0,
+                    "timestamp": datetime(2024, 1, 1, 18, 0, i).isoformat(),
+                })
+            history["".join(day)] = stats
+        profiles.append(history)
+    return profiles
+
+
+def measure(build, *args):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    data = build(*args)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--foods", type=int, default=4, help="food entries per day")
+    parser.add_argument("--workouts", type=int, default=1, help="workout entries per day")
+    parser.add_argument("--budget", type=int, default=None, help="max bytes per user")
+    args = parser.parse_args()
+
+    build_args = (args.users, args.days, args.foods, args.workouts)
+    compact = measure(build_compact, *build_args) / args.users
+    reference = measure(build_reference, *build_args) / args.users
+
+    print(f"users={args.users} days={args.days} foods/day={args.foods} workouts/day={args.workouts}")
+    print(f"compact:   {compact:10.0f} bytes/user")
+    print(f"reference: {reference:10.0f} bytes/user (dict entries, ISO timestamps)")
+    print(f"ratio:     {reference / compact:10.2f}x")
+
+    if args.budget is not None and compact > args.budget:
+        print(f"FAIL: {compact:.0f} bytes/user exceeds budget of {args.budget}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
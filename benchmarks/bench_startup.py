@@ -0,0 +1,78 @@
+"""Cold start time of the bot process and an import-time report.
+
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 3000 --report 15
+
+Measures the wall time of `python -c "import bot"` in fresh interpreters
+(the median of `--runs`) and fails when it exceeds `--budget-ms`. With
+`--report N` it also prints the N slowest imports by cumulative time from
+`python -X importtime`.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENV = {
+    "BOT_TOKEN": "123456:startup-bench",
+    "WEATHER_API_KEY": "startup-bench",
+}
+
+
+def child_env():
+    env = dict(os.environ)
+    for key, value in ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def time_import(target):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {target}"], cwd=ROOT, env=child_env(), check=True,
+                   stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+def import_report(target, top):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {target}"], cwd=ROOT,
+                            env=child_env(), check=True, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="bot", help="module to import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--report", type=int, default=0, metavar="N", help="show the N slowest imports")
+    args = parser.parse_args()
+
+    timings = [time_import(args.target) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import {args.target}: median {median:.0f} ms, min {min(timings):.0f} ms, "
+          f"max {max(timings):.0f} ms over {args.runs} runs")
+
+    if args.report:
+        print()
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative_us, self_us, name in import_report(args.target, args.report):
+            print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"FAIL: median startup {median:.0f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Synthetic load test of the dispatcher, middlewares and handlers.
+
+    python benchmarks/load_test.py --users 200 --actions 20 --concurrency 50 \\
+        --weather-latency-ms 80 --food-latency-ms 150
+    python benchmarks/load_test.py --error-rate 0.3 --slow-rate 0.1 --slow-ms 8000
+
+Every simulated user goes through /set_profile and then a random mix of
+/log_water, multi-step /log_food and /log_workout, and /check_progress.
+Updates are fed through the real Dispatcher built by `bot.create_dispatcher`
+with a fake Bot session, while OpenWeather and Open Food Facts are replaced
+by local stub servers with configurable latency, error rate and share of
+very slow responses, which exercises the rate limits, circuit breakers and
+deadline budgets of `resilience.py`. Prints throughput, per-command latency
+percentiles, upstream outcomes and memory growth.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_tmp = tempfile.mkdtemp(prefix="bot-load-")
+os.environ.setdefault("BOT_TOKEN", "123456:load-test")
+os.environ.setdefault("WEATHER_API_KEY", "load-test")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("FSM_STORAGE", "memory")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("FOOD_INDEX_PATH", os.path.join(_tmp, "missing.sqlite"))
+os.environ.setdefault("FOOD_CACHE_PATH", os.path.join(_tmp, "food_cache.sqlite"))
+os.environ.setdefault("LOG_MESSAGE_SAMPLE_RATE", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# The stubs are not subject to the real APIs' rate limits
+os.environ.setdefault("WEATHER_RATE_LIMIT", "1000000")
+os.environ.setdefault("FOOD_RATE_LIMIT", "1000000")
+os.environ.setdefault("WEATHER_CONCURRENCY", "1000")
+os.environ.setdefault("FOOD_CONCURRENCY", "1000")
+# Simulated users send far faster than people; measure the handlers, not the shedding
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+os.environ.setdefault("REMINDERS_ENABLED", "false")
+os.environ.setdefault("WARMUP_ENABLED", "false")
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+import external_api  # noqa: E402
+from bot import create_dispatcher  # noqa: E402
+from metrics import upstream_latency  # noqa: E402
+
+CITIES = ["Moscow", "London", "Paris", "Berlin", "Tbilisi", "Madrid", "Rome", "Vienna", "Prague", "Warsaw"]
+FOODS = ["banana", "oatmeal", "coffee", "apple", "bread", "cheese", "rice", "chicken"]
+WORKOUTS = ["run", "walk", "jump", "tennis", "football"]
+
+
+class FakeSession(BaseSession):
+    """Bot session that answers every API call locally."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.calls,
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class StubUpstreams:
+    """Local stand-ins for the weather and food APIs."""
+
+    def __init__(self, weather_latency, food_latency, error_rate, slow_rate=0.0, slow_latency=0.0):
+        self.weather_latency = weather_latency
+        self.food_latency = food_latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = {"weather": 0, "food": 0}
+        self._runner = None
+
+    async def _respond(self, upstream, latency, payload):
+        self.requests[upstream] += 1
+        if random.random() < self.slow_rate:
+            latency += self.slow_latency
+        await asyncio.sleep(latency)
+        if random.random() < self.error_rate:
+            return web.json_response({"error": "injected"}, status=503)
+        return web.json_response(payload)
+
+    async def weather(self, request):
+        return await self._respond("weather", self.weather_latency, {"main": {"temp": random.uniform(-5, 32)}})
+
+    async def food(self, request):
+        name = request.query.get("search_terms", "food")
+        payload = {"products": [{"product_name": name, "nutriments": {"energy-kcal_100g": 120}}]}
+        return await self._respond("food", self.food_latency, payload)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/weather", self.weather)
+        app.router.add_get("/food", self.food)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+def make_update(update_id, user_id, text):
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"),
+            text=text,
+        ),
+    )
+
+
+def user_script(user_id, actions, rng):
+    """Yield (label, text) pairs for one simulated user."""
+    yield "set_profile", "/set_profile"
+    yield "profile:weight", str(rng.randint(50, 110))
+    yield "profile:height", str(rng.randint(150, 200))
+    yield "profile:age", str(rng.randint(18, 70))
+    yield "profile:activity", str(rng.choice([0, 30, 60, 90]))
+    yield "profile:city", rng.choice(CITIES)
+
+    for _ in range(actions):
+        action = rng.choices(
+            ["log_water", "log_food", "log_workout", "check_progress"], weights=[40, 25, 15, 20]
+        )[0]
+        if action == "log_water":
+            yield "log_water", f"/log_water {rng.choice([150, 250, 330, 500])}"
+        elif action == "log_food":
+            yield "log_food", f"/log_food {rng.choice(FOODS)}"
+            yield "log_food:weight", str(rng.randint(50, 300))
+        elif action == "log_workout":
+            yield "log_workout", f"/log_workout {rng.choice(WORKOUTS)}"
+            yield "log_workout:duration", str(rng.choice([15, 30, 45, 60]))
+        else:
+            yield "check_progress", "/check_progress"
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+async def run(args):
+    upstreams = StubUpstreams(args.weather_latency_ms / 1000, args.food_latency_ms / 1000, args.error_rate,
+                              args.slow_rate, args.slow_ms / 1000)
+    base_url = await upstreams.start()
+    external_api.WEATHER_API_URL = base_url + "/weather"
+    external_api.FOOD_API_URL = base_url + "/food"
+
+    session = FakeSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    dp = create_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    latencies = {}
+    errors = 0
+    update_ids = iter(range(1, sys.maxsize))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user_id):
+        nonlocal errors
+        rng = random.Random(args.seed + user_id)
+        async with semaphore:
+            for label, text in user_script(user_id, args.actions, rng):
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, make_update(next(update_ids), user_id, text))
+                except Exception:
+                    errors += 1
+                latencies.setdefault(label, []).append(time.perf_counter() - started)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+    if args.trace_memory:
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    await upstreams.close()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"users={args.users} actions/user={args.actions} concurrency={args.concurrency} "
+          f"weather={args.weather_latency_ms}ms food={args.food_latency_ms}ms errors={args.error_rate:.0%}")
+    print(f"updates: {total} in {elapsed:.2f}s -> {total / elapsed:.0f} updates/s, handler errors: {errors}")
+    print(f"bot API calls: {session.calls}, upstream requests: {upstreams.requests}")
+    outcomes = {
+        labels: count for name, labels, count in upstream_latency.samples() if name.endswith("_count")
+    }
+    print("upstream outcomes: " + ", ".join(f"{labels} {count}" for labels, count in sorted(outcomes.items())))
+    print(f"memory: RSS {rss_before / 2**20:.1f} -> {rss_after / 2**20:.1f} MiB "
+          f"(+{(rss_after - rss_before) / 2**20:.1f} MiB)")
+    if args.trace_memory:
+        print(f"        traced {traced / 2**20:.1f} MiB retained, peak {traced_peak / 2**20:.1f} MiB")
+    print()
+    print(f"{'command':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{label:<22} {len(values):>7} "
+              + " ".join(f"{percentile(values, q) * 1000:>9.2f}" for q in (0.5, 0.95, 0.99))
+              + f" {values[-1] * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--actions", type=int, default=20, help="actions per user after profile setup")
+    parser.add_argument("--concurrency", type=int, default=50, help="users active at the same time")
+    parser.add_argument("--weather-latency-ms", type=float, default=50)
+    parser.add_argument("--food-latency-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests failing")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of upstream requests delayed by --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report tracemalloc totals (slows the run down)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,92 @@
 import asyncio
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, BOT_MODE, TELEGRAM_API_URL, METRICS_ENABLED, WARMUP_ENABLED, ROLLOVER_ENABLED,
+    POLLING_TASKS_LIMIT, REMINDERS_ENABLED, ADMISSION_ENABLED,
+)
 from logger import logger
 from handlers import router
-from middlewares import LoggingMiddleware, CheckCommandMiddleware
+from gazetteer import gazetteer
+from charts import chart_renderer
+from external_api import api_client
+from food_cache import food_cache
+from storage import storage
+from fsm_storage import create_fsm_storage
+from middlewares import (
+    LoggingMiddleware, CheckCommandMiddleware, DeadlineMiddleware, UserLaneMiddleware, AdmissionMiddleware
+)
+from metrics import MetricsMiddleware, metrics_server
+from outbound import OutboundLimiter
+from reminders import reminders
+from profiler import profiler
+from rollover import rollover
+from warmup import start_warmup
+from webhook import run_webhook
 
 
-async def main():
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
+async def on_startup(bot: Bot):
+    await api_client.start()
+    await storage.start()
+    await asyncio.to_thread(gazetteer.load)
+    if METRICS_ENABLED:
+        await metrics_server.start()
+    if WARMUP_ENABLED:
+        start_warmup()
+        chart_renderer.start()
+    if ROLLOVER_ENABLED:
+        rollover.start()
+    if REMINDERS_ENABLED:
+        await reminders.start(bot)
+    profiler.install_signal_handler()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await reminders.close()
+    await rollover.close()
+    await storage.close()
+    await dispatcher.storage.close()
+    await food_cache.close()
+    await chart_renderer.close()
+    await api_client.close()
+    await metrics_server.close()
+
+
+def create_bot():
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    bot.session.middleware(OutboundLimiter())
+    return bot
+
+
+def create_dispatcher():
+    dp = Dispatcher(storage=create_fsm_storage())
+    if ADMISSION_ENABLED:
+        dp.update.outer_middleware(AdmissionMiddleware())
+    dp.update.outer_middleware(UserLaneMiddleware())
+    dp.message.middleware(MetricsMiddleware())
+    dp.message.middleware(DeadlineMiddleware())
     dp.message.middleware(LoggingMiddleware())
     dp.message.middleware(CheckCommandMiddleware())
     dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
 
-    logger.info("Bot started!")
-    await dp.start_polling(bot)
+    logger.info("Bot started in {} mode!", BOT_MODE)
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot, tasks_concurrency_limit=POLLING_TASKS_LIMIT or None)
 
 if __name__ == '__main__':
     asyncio.run(main())
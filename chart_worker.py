@@ -0,0 +1,60 @@
+"""Chart drawing, run in the chart worker processes.
+
+Imports only matplotlib and the standard library, so running a job loads
+nothing of the bot. Spawned processes still import the bot's main module
+as `__mp_main__`, which is why logger.py adds no file sinks in child
+processes.
+"""
+
+
+def init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    render_chart(chart_data_sample())
+
+
+def chart_data_sample():
+    return {
+        "days": ["2024-01-01", "2024-01-02"], "water": [1000.0, 2000.0], "water_goal": [2500.0, None],
+        "consumed": [1500.0, 0.0], "calorie_goal": [2000.0, None], "burned": [300.0, 0.0],
+    }
+
+
+def render_chart(data):
+    """Draw water and calories against the goals and return PNG bytes.
+
+    Uses `Figure` directly rather than pyplot, so no global state is kept
+    between renders.
+    """
+    import io
+    from matplotlib.figure import Figure
+
+    labels = [day[5:] for day in data["days"]]
+    positions = range(len(labels))
+    nan = float("nan")
+
+    figure = Figure(figsize=(8, 6), dpi=100)
+    water_axes, calories_axes = figure.subplots(2, 1, sharex=True)
+
+    water_axes.bar(positions, data["water"], color="#4a90d9", label="Drunk")
+    water_axes.plot(positions, [nan if goal is None else goal for goal in data["water_goal"]],
+                    color="#1f3b73", marker="o", label="Goal")
+    water_axes.set_ylabel("Water, ml")
+    water_axes.legend(loc="upper left")
+
+    width = 0.4
+    calories_axes.bar([p - width / 2 for p in positions], data["consumed"], width, color="#e8a33d", label="Consumed")
+    calories_axes.bar([p + width / 2 for p in positions], data["burned"], width, color="#5cb85c", label="Burned")
+    calories_axes.plot(positions, [nan if goal is None else goal for goal in data["calorie_goal"]],
+                       color="#8a4b08", marker="o", label="Goal")
+    calories_axes.set_ylabel("Calories, kcal")
+    calories_axes.legend(loc="upper left")
+
+    step = max(1, len(labels) // 15)
+    calories_axes.set_xticks(list(positions)[::step], labels[::step], rotation=45)
+    figure.suptitle(f"Progress {data['days'][0]} - {data['days'][-1]}")
+    figure.tight_layout()
+
+    output = io.BytesIO()
+    figure.savefig(output, format="png")
+    return output.getvalue()
@@ -0,0 +1,171 @@
+"""Progress charts rendered off the event loop.
+
+Charts are drawn with matplotlib in a pool of worker processes, so a
+render never blocks other users' updates. Workers are spawned once, import
+matplotlib with the Agg backend and draw a throwaway figure to load fonts
+before their first real job. The drawing code lives in chart_worker.py,
+which imports nothing of the bot.
+
+Rendered PNGs are cached under the SHA-256 of the plotted data: asking for
+the same chart again, by any user, is answered from memory, and after the
+first upload by the Telegram file_id without re-sending the image.
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from chart_worker import init_worker, render_chart
+from config import CHART_WORKERS, CHART_CACHE_SIZE
+from logger import logger
+from metrics import registry
+
+# Bump when the look of the charts changes to invalidate cached images
+CHART_STYLE = 1
+
+chart_render_latency = registry.histogram(
+    "bot_chart_render_seconds", "Chart render time in the worker pool",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+chart_requests = registry.counter(
+    "bot_chart_requests_total", "Chart requests by cache result", ["result"]
+)
+
+
+def chart_data(profile, start, end):
+    """Plotted values of `profile` for each day from `start` to `end`.
+
+    Returns plain lists so the data pickles cheaply and hashes stably. Days
+    without stats have zero logged values and no goals.
+    """
+    days, water, water_goal, consumed, calorie_goal, burned = [], [], [], [], [], []
+    day = start
+    while day <= end:
+        stats = profile.daily_stats.get(day.isoformat())
+        days.append(day.isoformat())
+        water.append(stats.logged_water if stats else 0.0)
+        water_goal.append(stats.water_goal if stats else None)
+        consumed.append(stats.logged_calories if stats else 0.0)
+        calorie_goal.append(stats.calorie_goal if stats else None)
+        burned.append(stats.burned_calories if stats else 0.0)
+        day += timedelta(days=1)
+    return {
+        "days": days, "water": water, "water_goal": water_goal,
+        "consumed": consumed, "calorie_goal": calorie_goal, "burned": burned,
+    }
+
+
+def chart_key(data):
+    payload = json.dumps([CHART_STYLE, data], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ChartCache:
+    """LRU of rendered charts by key, bounded by the total PNG size."""
+
+    def __init__(self, max_bytes=CHART_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        """Return `(png, file_id)` for `key`, or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, png, file_id=None):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous[0])
+        self._entries[key] = (png, file_id)
+        self._size += len(png)
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, (old_png, _) = self._entries.popitem(last=False)
+            self._size -= len(old_png)
+
+    def set_file_id(self, key, file_id):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries[key] = (entry[0], file_id)
+
+
+class ChartRenderer:
+    """Renders charts in `workers` processes, caching by content hash.
+
+    Concurrent requests for the same chart share one render.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, cache_size=CHART_CACHE_SIZE):
+        self.workers = workers
+        self.cache = ChartCache(cache_size)
+        self._executor = None
+        self._rendering = {}
+
+    def start(self):
+        """Spawn the workers in the background so the first chart is fast."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(int)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Spawned rather than forked: the bot process runs threads
+            # (SQLite, logging) that must not be copied mid-operation.
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker
+            )
+        return self._executor
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, cancel_futures=True)
+
+    async def render(self, data):
+        """Return `(key, png, file_id)` for `data`; file_id is None until the
+        chart has been uploaded once."""
+        key = chart_key(data)
+        cached = self.cache.get(key)
+        if cached is not None:
+            chart_requests.inc("hit")
+            return key, *cached
+
+        rendering = self._rendering.get(key)
+        if rendering is None:
+            chart_requests.inc("miss")
+            rendering = self._rendering[key] = asyncio.ensure_future(self._render(key, data))
+            rendering.add_done_callback(lambda _: self._rendering.pop(key, None))
+        else:
+            chart_requests.inc("shared")
+        # A caller that times out must not cancel the render others wait for
+        png = await asyncio.shield(rendering)
+        return key, png, None
+
+    async def _render(self, key, data):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            png = await loop.run_in_executor(executor, render_chart, data)
+        except BrokenProcessPool:
+            # A worker died; start a new pool for the next chart
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            logger.error("Chart worker pool broke, restarting it")
+            raise
+        chart_render_latency.observe(time.perf_counter() - started)
+        self.cache.put(key, png)
+        logger.debug("Rendered chart {} ({} bytes) in {:.0f} ms", key[:12], len(png),
+                     (time.perf_counter() - started) * 1000)
+        return png
+
+
+chart_renderer = ChartRenderer()
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,3 +12,138 @@ if not BOT_TOKEN:
 
 if not WEATHER_API_KEY:
     raise ValueError("Переменная окружения WEATHER_API_KEY не установлена!")
+
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", 600))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 1024))
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+HTTP_POOL_SIZE_PER_HOST = int(os.getenv("HTTP_POOL_SIZE_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 10))
+
+# Bundled and prebuilt read-only data, found wherever the bot is started from
+DATA_DIR = Path(__file__).parent / "data"
+
+FOOD_INDEX_PATH = os.getenv("FOOD_INDEX_PATH", str(DATA_DIR / "food_index.sqlite"))
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", str(DATA_DIR / "cities.tsv"))
+GAZETTEER_FUZZY_CUTOFF = float(os.getenv("GAZETTEER_FUZZY_CUTOFF", 0.8))
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "data/bot.sqlite")
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", 1.0))
+STORAGE_FLUSH_BATCH = int(os.getenv("STORAGE_FLUSH_BATCH", 500))
+# Profiles kept in memory by the SQLite storage, 0 for no limit
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", 10000))
+
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 25))
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = int(os.getenv("PORT", 8080))
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("Переменная окружения BOT_MODE должна быть polling или webhook!")
+
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ValueError("Переменная окружения WEBHOOK_BASE_URL не установлена!")
+
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("Переменная окружения WEBHOOK_SECRET не установлена!")
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "data/fsm.sqlite")
+FSM_TTL = int(os.getenv("FSM_TTL", 86400))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", 1.0))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9090))
+
+# Telegram user ids allowed to run admin commands such as /profile
+ADMIN_IDS = frozenset(int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip())
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", 30))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 300))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_LAG_THRESHOLD = float(os.getenv("PROFILE_LAG_THRESHOLD", 0.1))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "")
+
+ROLLOVER_ENABLED = os.getenv("ROLLOVER_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLOVER_INTERVAL = float(os.getenv("ROLLOVER_INTERVAL", 300))
+ROLLOVER_LEAD = float(os.getenv("ROLLOVER_LEAD", 900))
+ROLLOVER_CONCURRENCY = int(os.getenv("ROLLOVER_CONCURRENCY", 10))
+ROLLOVER_BATCH = int(os.getenv("ROLLOVER_BATCH", 1000))
+
+HANDLER_DEADLINE = float(os.getenv("HANDLER_DEADLINE", 5))
+# OpenWeather free plan: 60 calls per minute
+WEATHER_RATE_LIMIT = float(os.getenv("WEATHER_RATE_LIMIT", 1))
+WEATHER_BURST = int(os.getenv("WEATHER_BURST", 60))
+WEATHER_CONCURRENCY = int(os.getenv("WEATHER_CONCURRENCY", 10))
+# Open Food Facts search: 10 requests per minute
+FOOD_RATE_LIMIT = float(os.getenv("FOOD_RATE_LIMIT", 10 / 60))
+FOOD_BURST = int(os.getenv("FOOD_BURST", 10))
+FOOD_CONCURRENCY = int(os.getenv("FOOD_CONCURRENCY", 4))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+# Requests left with less of the handler deadline are not sent
+UPSTREAM_MIN_TIMEOUT = float(os.getenv("UPSTREAM_MIN_TIMEOUT", 0.5))
+
+FOOD_CACHE_PATH = os.getenv("FOOD_CACHE_PATH", "data/food_cache.sqlite")
+FOOD_CACHE_TTL = float(os.getenv("FOOD_CACHE_TTL", 7 * 86400))
+FOOD_CACHE_MISS_TTL = float(os.getenv("FOOD_CACHE_MISS_TTL", 3600))
+FOOD_CACHE_SIZE = int(os.getenv("FOOD_CACHE_SIZE", 50000))
+FOOD_CACHE_FLUSH_INTERVAL = float(os.getenv("FOOD_CACHE_FLUSH_INTERVAL", 1.0))
+
+USER_QUEUE_SIZE = int(os.getenv("USER_QUEUE_SIZE", 20))
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Per-user limits as "<command>=<messages per second>/<burst>", "*" for all other messages
+ADMISSION_LIMITS = os.getenv(
+    "ADMISSION_LIMITS",
+    "*=1/10,/help=2/5,/start=2/5,/log_food=0.2/3,/check_progress=0.2/3,/history=0.2/3,/chart=0.1/2,/export=0.02/1",
+)
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", 200))
+ADMISSION_GLOBAL_BURST = int(os.getenv("ADMISSION_GLOBAL_BURST", 400))
+ADMISSION_COALESCE_WINDOW = float(os.getenv("ADMISSION_COALESCE_WINDOW", 2))
+ADMISSION_NOTICE_INTERVAL = float(os.getenv("ADMISSION_NOTICE_INTERVAL", 30))
+POLLING_TASKS_LIMIT = int(os.getenv("POLLING_TASKS_LIMIT", 256))
+
+MEAL_MAX_ITEMS = int(os.getenv("MEAL_MAX_ITEMS", 20))
+MEAL_LOOKUP_CONCURRENCY = int(os.getenv("MEAL_LOOKUP_CONCURRENCY", 4))
+
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", 1024 * 1024))
+# Telegram Bot API limit for uploaded documents
+EXPORT_MAX_SIZE = int(os.getenv("EXPORT_MAX_SIZE", 50 * 1024 * 1024))
+
+# Telegram flood limits: about 30 messages per second overall, 1 per second per chat
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 30))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", 30))
+OUTBOUND_CHAT_INTERVAL = float(os.getenv("OUTBOUND_CHAT_INTERVAL", 1))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() in ("1", "true", "yes")
+REMINDER_INTERVAL = float(os.getenv("REMINDER_INTERVAL", 7200))
+REMINDER_START_HOUR = int(os.getenv("REMINDER_START_HOUR", 9))
+REMINDER_END_HOUR = int(os.getenv("REMINDER_END_HOUR", 21))
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", 50))
+
+if not 0 <= REMINDER_START_HOUR < REMINDER_END_HOUR <= 24:
+    raise ValueError("Часы напоминаний должны удовлетворять 0 <= REMINDER_START_HOUR < REMINDER_END_HOUR <= 24!")
+
+HISTORY_MAX_DAYS = int(os.getenv("HISTORY_MAX_DAYS", 3660))
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", min(2, os.cpu_count() or 1)))
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 32 * 1024 * 1024))
+CHART_DAYS = int(os.getenv("CHART_DAYS", 14))
+CHART_MAX_DAYS = int(os.getenv("CHART_MAX_DAYS", 90))
@@ -0,0 +1,192 @@
+"""Export of raw history: daily goals and totals, food and workout entries.
+
+One user's history is sent by `/export`. All users are exported for
+analytics straight from the storage database:
+
+    python export.py --format jsonl --gzip --output exports/history.jsonl.gz
+
+Rows are produced by generators and written in small chunks, so memory
+stays bounded however long the history is.
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+from aiogram.types.input_file import InputFile, DEFAULT_CHUNK_SIZE
+
+from config import STORAGE_PATH, EXPORT_SPOOL_SIZE
+
+FORMATS = ("csv", "jsonl")
+
+FIELDS = (
+    "user_id", "date", "kind", "name", "amount", "calories", "timestamp",
+    "water", "water_goal", "consumed", "calorie_goal", "burned", "temperature",
+)
+
+WRITE_CHUNK_SIZE = 64 * 1024
+
+_NO_DAY_FIELDS = (None,) * 6
+_NO_ENTRY_FIELDS = (None,) * 4
+
+
+def _day_row(user_id, date, water, consumed, burned, water_goal, calorie_goal, temperature):
+    return (user_id, date, "day", *_NO_ENTRY_FIELDS,
+            water, water_goal, consumed, calorie_goal, burned, temperature)
+
+
+def _entry_row(user_id, date, kind, name, amount, calories, timestamp):
+    return (user_id, date, kind, name, amount, calories, timestamp, *_NO_DAY_FIELDS)
+
+
+def iter_profile_rows(profile):
+    """Rows of one profile: each day followed by its food and workout entries.
+
+    The list of days is taken right away, so the rows can be consumed in
+    another thread while the bot adds new days.
+    """
+    return _iter_days(profile.user_id, sorted(profile.daily_stats.items()))
+
+
+def _iter_days(user_id, days):
+    for key, stats in days:
+        yield _day_row(user_id, key, stats.logged_water, stats.logged_calories, stats.burned_calories,
+                       stats.water_goal, stats.calorie_goal, stats.temperature)
+        for entry in stats.food_log:
+            yield _entry_row(user_id, key, "food", *entry)
+        for entry in stats.workout_log:
+            yield _entry_row(user_id, key, "workout", *entry)
+
+
+def iter_database_rows(path=STORAGE_PATH):
+    """Rows of every user read from the storage database in one pass.
+
+    The three tables are read with separate cursors sorted by user and day
+    and merged lazily into the same order as `iter_profile_rows`.
+    """
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        days = db.execute(
+            "SELECT user_id, date, 0, logged_water, logged_calories, burned_calories, "
+            "water_goal, calorie_goal, temperature FROM daily_stats ORDER BY user_id, date"
+        )
+        food = db.execute(
+            "SELECT user_id, date, 1, name, weight, calories, timestamp FROM food_log "
+            "ORDER BY user_id, date, rowid"
+        )
+        workouts = db.execute(
+            "SELECT user_id, date, 2, type, duration, calories, timestamp FROM workout_log "
+            "ORDER BY user_id, date, rowid"
+        )
+        for user_id, date, kind, *values in heapq.merge(days, food, workouts, key=lambda row: row[:3]):
+            if kind == 0:
+                yield _day_row(user_id, date, *values)
+            else:
+                yield _entry_row(user_id, date, "food" if kind == 1 else "workout", *values)
+    finally:
+        db.close()
+
+
+class _ChunkedWriter:
+    """Collects text and writes it to a binary file encoded, in chunks."""
+
+    def __init__(self, file, chunk_size=WRITE_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self.file.write("".join(self._parts).encode("utf-8"))
+            self._parts.clear()
+            self._size = 0
+
+
+def write_rows(rows, file, fmt="csv", compress=False):
+    """Write `rows` as CSV or JSON lines to the binary `file`, gzipped if asked.
+
+    `file` is left open.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    binary = gzip.GzipFile(fileobj=file, mode="wb") if compress else file
+    text = _ChunkedWriter(binary)
+    try:
+        if fmt == "csv":
+            writer = csv.writer(text)
+            writer.writerow(FIELDS)
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                record = {name: value for name, value in zip(FIELDS, row) if value is not None}
+                text.write(json.dumps(record, ensure_ascii=False))
+                text.write("\n")
+        text.flush()
+    finally:
+        if compress:
+            binary.close()
+
+
+def spool_rows(rows, fmt="csv", compress=False):
+    """Write `rows` into a temporary file, rewound for reading.
+
+    The file stays in memory up to EXPORT_SPOOL_SIZE bytes and moves to
+    disk beyond that. The caller closes it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        write_rows(rows, spool, fmt, compress)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def export_filename(user_id, day, fmt="csv", compress=False):
+    return f"history_{user_id}_{day}.{fmt}" + (".gz" if compress else "")
+
+
+class StreamInputFile(InputFile):
+    """Uploads an open binary file in chunks instead of reading it whole."""
+
+    def __init__(self, file, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the history of all users for analytics.")
+    parser.add_argument("--storage", default=STORAGE_PATH, help="storage database")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args()
+
+    if args.output == "-":
+        write_rows(iter_database_rows(args.storage), sys.stdout.buffer, args.format, args.gzip)
+        return
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "wb") as output:
+        write_rows(iter_database_rows(args.storage), output, args.format, args.gzip)
+
+
+if __name__ == "__main__":
+    main()
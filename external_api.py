@@ -1,31 +1,180 @@
-import requests
-import datetime
 import asyncio
+import time
 import aiohttp
 from logger import logger
+from config import (
+    WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE,
+    HTTP_POOL_SIZE, HTTP_POOL_SIZE_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL,
+    HTTP_CONNECT_TIMEOUT, HTTP_TOTAL_TIMEOUT,
+    WEATHER_RATE_LIMIT, WEATHER_BURST, WEATHER_CONCURRENCY,
+    FOOD_RATE_LIMIT, FOOD_BURST, FOOD_CONCURRENCY,
+    BREAKER_FAILURES, BREAKER_RESET_TIMEOUT, UPSTREAM_MIN_TIMEOUT,
+)
+from weather_cache import WeatherCache, normalize_city
+from gazetteer import gazetteer
+from food_index import food_index, normalize_query
+from food_cache import food_cache
+from metrics import registry, observe_upstream
+from resilience import UpstreamGuard, UpstreamUnavailable, clear_deadline
 
 WEATHER_API_URL = "http://api.openweathermap.org/data/2.5/weather"
 FOOD_API_URL = "https://world.openfoodfacts.org/cgi/search.pl"
 
+WEATHER_UPSTREAM = "weather"
+FOOD_UPSTREAM = "food"
 
-async def get_temperature(city, api_key):
+
+class ApiClient:
+    """Holds one pooled, keep-alive aiohttp session per upstream.
+
+    Sessions are created lazily on first use and closed by `close()`,
+    which the bot calls from the Dispatcher shutdown hook.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def _create_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_SIZE_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def session(self, upstream):
+        session = self._sessions.get(upstream)
+        if session is None or session.closed:
+            session = self._create_session()
+            self._sessions[upstream] = session
+        return session
+
+    async def start(self):
+        for upstream in (WEATHER_UPSTREAM, FOOD_UPSTREAM):
+            self.session(upstream)
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
+api_client = ApiClient()
+weather_cache = WeatherCache(ttl=WEATHER_CACHE_TTL, max_size=WEATHER_CACHE_SIZE)
+
+weather_guard = UpstreamGuard(
+    WEATHER_UPSTREAM, WEATHER_RATE_LIMIT, WEATHER_BURST, WEATHER_CONCURRENCY,
+    BREAKER_FAILURES, BREAKER_RESET_TIMEOUT, HTTP_TOTAL_TIMEOUT, UPSTREAM_MIN_TIMEOUT,
+)
+food_guard = UpstreamGuard(
+    FOOD_UPSTREAM, FOOD_RATE_LIMIT, FOOD_BURST, FOOD_CONCURRENCY,
+    BREAKER_FAILURES, BREAKER_RESET_TIMEOUT, HTTP_TOTAL_TIMEOUT, UPSTREAM_MIN_TIMEOUT,
+)
+
+registry.counter("bot_weather_cache_hits_total", "Weather cache hits",
+                 callback=lambda: weather_cache.hits)
+registry.counter("bot_weather_cache_misses_total", "Weather cache misses",
+                 callback=lambda: weather_cache.misses)
+
+
+def weather_location(city, city_id=0):
+    """Cache key and query of the weather in a city.
+
+    Cities known to the gazetteer are requested by coordinates and cached
+    under their id, whatever spelling the user typed; others by name.
+    """
+    place = gazetteer.get(city_id) if city_id else gazetteer.lookup(city)
+    if place is None:
+        return normalize_city(city), {'q': city}
+    return f"city:{place.id}", {'lat': place.latitude, 'lon': place.longitude}
+
+
+async def get_temperature(city, api_key, city_id=0):
+    """Current temperature in `city`, or the last known one if the weather
+    API cannot be reached. None if neither is available."""
+    key, query = weather_location(city, city_id)
+    temperature = await weather_cache.get_or_fetch(key, lambda: fetch_temperature(city, api_key, query))
+    if temperature is None:
+        temperature = weather_cache.get_stale(key)
+    return temperature
+
+
+async def fetch_temperature(city, api_key, query=None):
     params = {
-            'q': city,
+            **(query or {'q': city}),
             'appid': api_key,
             'units': 'metric'
         }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(WEATHER_API_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data["main"]["temp"]
-            logger.error("Get temperature http response error: {}", response.status)
-    
+
+    session = api_client.session(WEATHER_UPSTREAM)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        async with weather_guard.slot() as timeout:
+            async with session.get(WEATHER_API_URL, params=params, timeout=timeout) as response:
+                status = response.status
+                weather_guard.record(status)
+                if response.status == 200:
+                    data = await response.json()
+                    return data["main"]["temp"]
+                logger.error("Get temperature http response error: {}", response.status)
+    except UpstreamUnavailable as e:
+        status = e.reason
+        logger.warning("Weather API unavailable for city {}: {}", city, e.reason)
+    except asyncio.TimeoutError:
+        status = "timeout"
+        logger.error("Get temperature timed out for city {}", city)
+    except aiohttp.ClientError as e:
+        logger.error("Get temperature request failed: {}", e)
+    finally:
+        observe_upstream(WEATHER_UPSTREAM, status, started)
+
     return None
 
 
 async def get_food_info(product_name):
+    if food_index.available:
+        started = time.perf_counter()
+        try:
+            products = await asyncio.to_thread(food_index.search, product_name, 1)
+        except Exception as e:
+            observe_upstream("food_index", "error", started)
+            logger.error("Local food index lookup failed: {}", e)
+        else:
+            observe_upstream("food_index", "hit" if products else "miss", started)
+            if products:
+                return products[0]
+
+    query = normalize_query(product_name)
+    started = time.perf_counter()
+    cached = await food_cache.get(query)
+    if cached is not None:
+        info, stale = cached
+        observe_upstream("food_cache", "stale" if stale else "hit", started)
+        if stale:
+            food_cache.refresh(query, lambda: _refresh_food_info(product_name))
+        return info
+    observe_upstream("food_cache", "miss", started)
+
+    info = await fetch_food_info(product_name)
+    if info is not None and not info.get("error"):
+        await food_cache.put(query, info)
+    return info
+
+
+async def _refresh_food_info(product_name):
+    clear_deadline()
+    return await fetch_food_info(product_name)
+
+
+async def fetch_food_info(product_name):
+    """Search Open Food Facts. Returns `{'name', 'calories'}`, `{}` when
+    nothing was found, or None when the request failed."""
     params = {
         "search_terms": product_name,
         "search_simple": 1,
@@ -35,18 +184,36 @@ async def get_food_info(product_name):
         "page_size": 1
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(FOOD_API_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                products = data.get('products', [])
-                if products:
-                    first_product = products[0]
-                    return {
-                        'name': first_product.get('product_name', 'Неизвестно'),
-                        'calories': first_product.get('nutriments', {}).get('energy-kcal_100g', 0)
-                    }
-            else:
-                logger.error("Get food info http response error: {}", response.status)
-    
+    session = api_client.session(FOOD_UPSTREAM)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        async with food_guard.slot() as timeout:
+            async with session.get(FOOD_API_URL, params=params, timeout=timeout) as response:
+                status = response.status
+                food_guard.record(status)
+                if response.status == 200:
+                    data = await response.json()
+                    products = data.get('products', [])
+                    if products:
+                        first_product = products[0]
+                        return {
+                            'name': first_product.get('product_name', 'Неизвестно'),
+                            'calories': first_product.get('nutriments', {}).get('energy-kcal_100g', 0)
+                        }
+                    return {}
+                else:
+                    logger.error("Get food info http response error: {}", response.status)
+    except UpstreamUnavailable as e:
+        status = e.reason
+        logger.warning("Food API unavailable for {}: {}", product_name, e.reason)
+        return {"error": True, "name": "the food database is temporarily unavailable"}
+    except asyncio.TimeoutError:
+        status = "timeout"
+        logger.error("Get food info timed out for {}", product_name)
+    except aiohttp.ClientError as e:
+        logger.error("Get food info request failed: {}", e)
+    finally:
+        observe_upstream(FOOD_UPSTREAM, status, started)
+
     return None
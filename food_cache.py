@@ -0,0 +1,190 @@
+import asyncio
+import time
+from pathlib import Path
+
+import aiosqlite
+
+from config import (
+    FOOD_CACHE_PATH, FOOD_CACHE_TTL, FOOD_CACHE_MISS_TTL, FOOD_CACHE_SIZE, FOOD_CACHE_FLUSH_INTERVAL
+)
+from logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS food_cache (
+    query TEXT PRIMARY KEY,
+    name TEXT,
+    calories REAL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS food_cache_used_at ON food_cache (used_at);
+"""
+
+UPSERT = """
+INSERT INTO food_cache (query, name, calories, fetched_at, used_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (query) DO UPDATE SET
+    name = excluded.name,
+    calories = excluded.calories,
+    fetched_at = excluded.fetched_at,
+    used_at = excluded.used_at
+"""
+
+TOUCH = "UPDATE food_cache SET used_at = max(used_at, ?) WHERE query = ?"
+
+EVICT = """
+DELETE FROM food_cache WHERE query IN (
+    SELECT query FROM food_cache ORDER BY used_at
+    LIMIT max(0, (SELECT count(*) FROM food_cache) - ?)
+)
+"""
+
+
+class FoodCache:
+    """On-disk cache of food lookups keyed by normalized query.
+
+    Found products are fresh for `ttl` seconds and are served stale after
+    that while `refresh` fetches them again in the background. Queries that
+    found nothing are remembered as `{}` for `miss_ttl` seconds. The least
+    recently used entries are evicted beyond `max_entries`.
+
+    Lookups only read. New entries and the last use of entries are kept in
+    memory and written in one transaction every `flush_interval` seconds,
+    and eviction runs after every `max_entries // 10` new entries (at most
+    1000), so the table may briefly hold that many entries too many.
+    """
+
+    def __init__(self, path=FOOD_CACHE_PATH, ttl=FOOD_CACHE_TTL, miss_ttl=FOOD_CACHE_MISS_TTL,
+                 max_entries=FOOD_CACHE_SIZE, flush_interval=FOOD_CACHE_FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._evict_every = max(1, min(1000, max_entries // 10))
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._flusher = None
+        self._refreshing = {}
+        self._pending = {}
+        self._flushing = {}
+        self._used = {}
+        self._inserted = 0
+
+    async def _connection(self):
+        if self._db is None:
+            async with self._lock:
+                if self._db is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    db = await aiosqlite.connect(self.path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.executescript(SCHEMA)
+                    await db.commit()
+                    self._db = db
+                    self._flusher = asyncio.create_task(self._flush_loop())
+        return self._db
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+        if self._db is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            await self.flush()
+            await self._db.close()
+            self._db = None
+
+    async def get(self, query):
+        """Return `(info, stale)` for a cached query or None.
+
+        `info` is `{}` for a remembered miss; expired misses are not returned.
+        """
+        now = time.time()
+        row = self._pending.get(query) or self._flushing.get(query)
+        if row is None:
+            db = await self._connection()
+            async with db.execute(
+                "SELECT name, calories, fetched_at FROM food_cache WHERE query = ?", (query,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        name, calories, fetched_at = row
+        if name is None and now - fetched_at > self.miss_ttl:
+            return None
+        self._used[query] = now
+
+        if name is None:
+            return {}, False
+        return {"name": name, "calories": calories}, now - fetched_at > self.ttl
+
+    async def put(self, query, info):
+        """Store a lookup result; `{}` records that nothing was found."""
+        await self._connection()
+        self._pending[query] = (info.get("name"), info.get("calories"), time.time())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Food cache flush failed: {}", e)
+
+    async def flush(self):
+        """Write new entries and last uses, evicting if enough were added."""
+        async with self._lock:
+            if self._db is None or not (self._pending or self._used):
+                return
+            entries, self._pending = self._pending, {}
+            used, self._used = self._used, {}
+            self._flushing = entries
+            try:
+                await self._db.executemany(UPSERT, [
+                    (query, name, calories, fetched_at, used.get(query, fetched_at))
+                    for query, (name, calories, fetched_at) in entries.items()
+                ])
+                await self._db.executemany(TOUCH, [
+                    (used_at, query) for query, used_at in used.items() if query not in entries
+                ])
+                inserted = self._inserted + len(entries)
+                if inserted >= self._evict_every:
+                    await self._db.execute(EVICT, (self.max_entries,))
+                    inserted = 0
+                await self._db.commit()
+            except BaseException:
+                try:
+                    await self._db.rollback()
+                except Exception as e:
+                    logger.error("Food cache rollback failed: {}", e)
+                # Entries put again meanwhile hold the newer values
+                for query, entry in entries.items():
+                    self._pending.setdefault(query, entry)
+                for query, used_at in used.items():
+                    self._used.setdefault(query, used_at)
+                raise
+            finally:
+                self._flushing = {}
+            self._inserted = inserted
+
+    def refresh(self, query, fetch):
+        """Re-fetch `query` in the background unless a refresh is already running."""
+        if query not in self._refreshing:
+            self._refreshing[query] = asyncio.create_task(self._refresh(query, fetch))
+
+    async def _refresh(self, query, fetch):
+        try:
+            info = await fetch()
+            if info is not None and not info.get("error"):
+                await self.put(query, info)
+        except Exception as e:
+            logger.error("Food cache refresh failed for {}: {}", query, e)
+        finally:
+            self._refreshing.pop(query, None)
+
+
+food_cache = FoodCache()
@@ -0,0 +1,241 @@
+"""Offline nutrition index built from an Open Food Facts dump.
+
+Build it once from the CSV (tab separated) or JSONL export, optionally
+gzipped:
+
+    python food_index.py build en.openfoodfacts.org.products.csv.gz
+
+The index is a SQLite FTS5 table with the trigram tokenizer, so lookups
+tolerate typos and partial names. A lookup fetches a bounded set of
+candidates, containing all trigrams of the query or, failing that, any of
+its rarest ones, and ranks them by how many of the query's trigrams they
+contain, so common trigrams like "the" never turn it into a scan of the
+whole dump. Products sharing less than `MIN_OVERLAP` of the trigrams are
+not matches, so the caller can ask the API instead.
+"""
+import argparse
+import csv
+import gzip
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+from config import FOOD_INDEX_PATH
+
+BATCH_SIZE = 5000
+CALORIES_FIELD = "energy-kcal_100g"
+# Trigrams of a query that a product must share at least one of
+MATCH_TRIGRAMS = 6
+# Products ranked per lookup
+MAX_CANDIDATES = 500
+# Share of the query's trigrams a product must contain to be a match
+MIN_OVERLAP = 0.5
+
+
+def normalize_query(text):
+    return " ".join(str(text).split()).casefold()
+
+
+def trigrams(text):
+    grams = []
+    for word in normalize_query(text).split():
+        if len(word) < 3:
+            continue
+        for i in range(len(word) - 2):
+            gram = word[i:i + 3]
+            if gram not in grams:
+                grams.append(gram)
+    return grams
+
+
+def _open_dump(path):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+
+def _parse_calories(value):
+    try:
+        calories = float(value)
+    except (TypeError, ValueError):
+        return None
+    if calories < 0 or calories > 1000:
+        return None
+    return calories
+
+
+def iter_csv_products(stream):
+    csv.field_size_limit(sys.maxsize)
+    reader = csv.DictReader(stream, delimiter="\t", quoting=csv.QUOTE_NONE)
+    for row in reader:
+        yield row.get("product_name"), row.get(CALORIES_FIELD)
+
+
+def iter_jsonl_products(stream):
+    for line in stream:
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        yield product.get("product_name"), (product.get("nutriments") or {}).get(CALORIES_FIELD)
+
+
+def iter_products(path):
+    """Stream (name, calories) pairs from a dump without loading it into memory."""
+    name = Path(path).name
+    is_jsonl = ".jsonl" in name or ".json" in name
+    with _open_dump(path) as stream:
+        rows = iter_jsonl_products(stream) if is_jsonl else iter_csv_products(stream)
+        for product_name, calories in rows:
+            product_name = (product_name or "").strip()
+            calories = _parse_calories(calories)
+            if product_name and calories is not None:
+                yield product_name, calories
+
+
+def build_index(dump_path, index_path=FOOD_INDEX_PATH, batch_size=BATCH_SIZE):
+    index_path = Path(index_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix(index_path.suffix + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        "CREATE VIRTUAL TABLE products USING fts5("
+        "name, calories UNINDEXED, tokenize='trigram')"
+    )
+
+    count = 0
+    batch = []
+    for product in iter_products(dump_path):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            conn.executemany("INSERT INTO products(name, calories) VALUES (?, ?)", batch)
+            count += len(batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO products(name, calories) VALUES (?, ?)", batch)
+        count += len(batch)
+
+    conn.execute("INSERT INTO products(products) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    tmp_path.replace(index_path)
+    return count
+
+
+class FoodIndex:
+    """Read-only access to the index.
+
+    Lookups block on SQLite, so callers on the event loop run them in a
+    thread; each thread gets its own connection.
+    """
+
+    def __init__(self, path=FOOD_INDEX_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return bool(self._connections) or self.path.exists()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("CREATE VIRTUAL TABLE temp.vocab USING fts5vocab(main, products, row)")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _rarest(self, conn, grams):
+        """The trigrams of `grams` found in the index, rarest first."""
+        placeholders = ", ".join("?" * len(grams))
+        counts = dict(conn.execute(f"SELECT term, doc FROM temp.vocab WHERE term IN ({placeholders})", grams))
+        return sorted(counts, key=counts.get)
+
+    def search(self, query, limit=5):
+        """Return up to `limit` products ranked by trigram overlap with `query`."""
+        grams = trigrams(query)
+        if not grams or not self.available:
+            return []
+
+        conn = self._connection()
+        rare = self._rarest(conn, grams)
+        if not rare:
+            return []
+        # Products containing every trigram first, then, for typos, products
+        # sharing any of the rarest ones
+        candidates = []
+        if len(rare) == len(grams):
+            candidates = self._candidates(conn, rare, " AND ")
+        if len(candidates) < limit:
+            candidates += self._candidates(conn, rare[:MATCH_TRIGRAMS], " OR ")
+
+        wanted = set(grams)
+        needed = MIN_OVERLAP * len(wanted)
+        ranked = {}
+        for name, calories in candidates:
+            overlap = len(wanted.intersection(trigrams(name)))
+            if overlap >= needed:
+                ranked.setdefault(name, (-overlap, len(name), calories))
+        best = sorted(ranked.items(), key=lambda item: item[1][:2])[:limit]
+        return [{"name": name, "calories": calories} for name, (_, _, calories) in best]
+
+    def _candidates(self, conn, grams, operator):
+        match = operator.join('"{}"'.format(gram.replace('"', '""')) for gram in grams)
+        return conn.execute(
+            "SELECT name, calories FROM products WHERE products MATCH ? LIMIT ?",
+            (match, MAX_CANDIDATES),
+        ).fetchall()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+food_index = FoodIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Open Food Facts index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build the index from a CSV/JSONL dump")
+    build.add_argument("dump", help="path to the dump (.csv, .jsonl, optionally .gz)")
+    build.add_argument("--index", default=FOOD_INDEX_PATH, help="output index path")
+
+    search = subparsers.add_parser("search", help="query the index")
+    search.add_argument("query")
+    search.add_argument("--index", default=FOOD_INDEX_PATH)
+    search.add_argument("--limit", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        started = time.perf_counter()
+        count = build_index(args.dump, args.index)
+        print(f"Indexed {count} products in {time.perf_counter() - started:.1f}s")
+    else:
+        index = FoodIndex(args.index)
+        started = time.perf_counter()
+        results = index.search(args.query, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        for product in results:
+            print(f"{product['name']}: {product['calories']} kcal/100g")
+        print(f"{len(results)} results in {elapsed:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE, FSM_STORAGE_PATH, FSM_TTL, FSM_CACHE_TTL
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at);
+"""
+
+UPSERT_STATE = """
+INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, '{}', ?)
+ON CONFLICT (key) DO UPDATE SET
+    state = excluded.state,
+    data = CASE WHEN fsm.expires_at < ? THEN '{}' ELSE fsm.data END,
+    expires_at = excluded.expires_at
+"""
+
+UPSERT_DATA = """
+INSERT INTO fsm (key, state, data, expires_at) VALUES (?, NULL, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    state = CASE WHEN fsm.expires_at < ? THEN NULL ELSE fsm.state END,
+    data = excluded.data,
+    expires_at = excluded.expires_at
+"""
+
+PURGE_INTERVAL = 600
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """FSM storage in a SQLite (WAL) file shared by processes on one host.
+
+    Every write refreshes the record's expiry, so a conversation abandoned
+    for `ttl` seconds is forgotten. Reads go through a small in-process
+    cache that keeps records for `cache_ttl` seconds; this removes the
+    repeated lookups aiogram makes while handling a single update. Set
+    `cache_ttl` to 0 when several processes serve the same users without
+    sticky routing.
+    """
+
+    def __init__(self, path=FSM_STORAGE_PATH, ttl=FSM_TTL, cache_ttl=FSM_CACHE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.key_builder = DefaultKeyBuilder()
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._cache = {}
+        self._cache_pruned_at = 0.0
+        self._purged_at = 0
+
+    async def _connection(self):
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = await aiosqlite.connect(self.path, timeout=30)
+            await self._db.execute("PRAGMA journal_mode=WAL")
+            await self._db.execute("PRAGMA synchronous=NORMAL")
+            await self._db.execute("PRAGMA busy_timeout=5000")
+            await self._db.executescript(SCHEMA)
+            await self._db.commit()
+        return self._db
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        self._cache.clear()
+
+    def _cached(self, key):
+        record = self._cache.get(key)
+        if record is None:
+            return None
+        cached_at, state, data = record
+        if time.monotonic() - cached_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        return state, data
+
+    def _remember(self, key, state, data):
+        if self.cache_ttl <= 0:
+            return
+        now = time.monotonic()
+        # Users who never come back would otherwise stay cached forever
+        if now - self._cache_pruned_at > self.cache_ttl:
+            self._cache_pruned_at = now
+            self._cache = {
+                key: record for key, record in self._cache.items() if now - record[0] <= self.cache_ttl
+            }
+        self._cache[key] = (now, state, data)
+
+    async def _read(self, key):
+        record = self._cached(key)
+        if record is not None:
+            return record
+
+        async with self._lock:
+            db = await self._connection()
+            async with db.execute(
+                "SELECT state, data FROM fsm WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ) as cursor:
+                row = await cursor.fetchone()
+        state, data = (row[0], json.loads(row[1])) if row else (None, {})
+        self._remember(key, state, data)
+        return state, data
+
+    async def _purge(self, db, now):
+        if now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        await db.execute("DELETE FROM fsm WHERE expires_at < ?", (now,))
+
+    async def set_state(self, key, state=None):
+        key = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        now = time.time()
+        async with self._lock:
+            db = await self._connection()
+            await db.execute(UPSERT_STATE, (key, state, now + self.ttl, now))
+            await self._purge(db, now)
+            await db.commit()
+        self._cache.pop(key, None)
+
+    async def get_state(self, key):
+        state, _ = await self._read(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        key = self.key_builder.build(key)
+        now = time.time()
+        async with self._lock:
+            db = await self._connection()
+            await db.execute(UPSERT_DATA, (key, json.dumps(data), now + self.ttl, now))
+            await self._purge(db, now)
+            await db.commit()
+        self._cache.pop(key, None)
+
+    async def get_data(self, key):
+        _, data = await self._read(self.key_builder.build(key))
+        return dict(data)
+
+    async def update_data(self, key, data):
+        """Merge `data` into the stored dict atomically across processes."""
+        storage_key = self.key_builder.build(key)
+        now = time.time()
+        async with self._lock:
+            db = await self._connection()
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                async with db.execute(
+                    "SELECT data FROM fsm WHERE key = ? AND expires_at >= ?", (storage_key, now)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                current = json.loads(row[0]) if row else {}
+                current.update(data)
+                await db.execute(UPSERT_DATA, (storage_key, json.dumps(current), now + self.ttl, now))
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        self._cache.pop(storage_key, None)
+        return dict(current)
+
+
+def create_fsm_storage(backend=FSM_STORAGE):
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteFSMStorage()
+    raise ValueError(f"Unknown FSM storage backend: {backend}")
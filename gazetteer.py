@@ -0,0 +1,181 @@
+"""Offline city gazetteer for resolving the city a user types.
+
+Cities are read from a file in the GeoNames `cities*.txt` layout (tab
+separated: id, name, ASCII name, comma separated alternate names, latitude,
+longitude, feature class and code, country code, ..., population, ...,
+timezone). The bot ships a small table of large cities in that layout in
+`data/cities.tsv`; point `GAZETTEER_PATH` at a full GeoNames dump such as
+cities15000.txt for wider coverage.
+
+Every name and alias is indexed after normalization of case, accents and
+punctuation, so "Moscow", "moscow " and "Москва" resolve to the same city
+without a network request, and close misspellings are matched with difflib:
+
+    python gazetteer.py search "sankt peterburg"
+"""
+import argparse
+import difflib
+import re
+import time
+import unicodedata
+from pathlib import Path
+from typing import NamedTuple
+
+from config import GAZETTEER_PATH, GAZETTEER_FUZZY_CUTOFF
+from logger import logger
+
+ID, NAME, ASCII_NAME, ALTERNATE_NAMES, LATITUDE, LONGITUDE = 0, 1, 2, 3, 4, 5
+COUNTRY, POPULATION, TIMEZONE = 8, 14, 17
+
+
+class City(NamedTuple):
+    id: int
+    name: str
+    country: str
+    latitude: float
+    longitude: float
+    timezone: str
+    population: int
+
+    @property
+    def label(self):
+        return f"{self.name}, {self.country}"
+
+
+def normalize_name(text):
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def _split_country(text):
+    """Split "Paris, FR" into ("Paris", "FR"); other text has no country."""
+    name, comma, country = str(text).rpartition(",")
+    country = country.strip()
+    if comma and len(country) == 2 and country.isalpha():
+        return name, country.upper()
+    return str(text), ""
+
+
+class Gazetteer:
+    """Name and alias index over the cities of a GeoNames-format file.
+
+    Loaded on first use. Each normalized alias maps to the ids of the cities
+    using it, most populous first. Fuzzy matching only compares aliases that
+    start with the same character as the input, which keeps it fast on a
+    full dump at the price of missing typos in the first letter.
+    """
+
+    def __init__(self, path=GAZETTEER_PATH, cutoff=GAZETTEER_FUZZY_CUTOFF):
+        self.path = Path(path)
+        self.cutoff = cutoff
+        self._cities = None
+        self._index = None
+        self._buckets = None
+
+    def __len__(self):
+        self.load()
+        return len(self._cities)
+
+    def load(self):
+        if self._cities is not None:
+            return
+        started = time.perf_counter()
+        cities = {}
+        index = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as rows:
+                for row in rows:
+                    fields = row.rstrip("\n").split("\t")
+                    if len(fields) <= TIMEZONE:
+                        continue
+                    try:
+                        city = City(
+                            int(fields[ID]), fields[NAME], fields[COUNTRY], float(fields[LATITUDE]),
+                            float(fields[LONGITUDE]), fields[TIMEZONE], int(fields[POPULATION] or 0),
+                        )
+                    except ValueError:
+                        continue
+                    cities[city.id] = city
+                    for alias in {fields[NAME], fields[ASCII_NAME], *fields[ALTERNATE_NAMES].split(",")}:
+                        key = normalize_name(alias)
+                        if key:
+                            index.setdefault(key, []).append(city.id)
+        else:
+            logger.warning("Gazetteer {} not found, cities are checked online only", self.path)
+
+        buckets = {}
+        for key, ids in index.items():
+            ids.sort(key=lambda city_id: -cities[city_id].population)
+            index[key] = tuple(dict.fromkeys(ids))
+            buckets.setdefault(key[0], []).append(key)
+        self._index, self._buckets, self._cities = index, buckets, cities
+        logger.debug("Loaded {} cities, {} names in {:.0f} ms", len(cities), len(index),
+                     (time.perf_counter() - started) * 1000)
+
+    def get(self, city_id):
+        self.load()
+        return self._cities.get(city_id)
+
+    def _first(self, key, country):
+        for city_id in self._index.get(key, ()):
+            city = self._cities[city_id]
+            if not country or city.country == country:
+                return city
+        return None
+
+    def lookup(self, text):
+        """City with exactly this name or alias, optionally followed by a
+        comma and a country code ("Paris, US"). The most populous wins."""
+        self.load()
+        name, country = _split_country(text)
+        city = self._first(normalize_name(name), country)
+        if city is None and country:
+            city = self._first(normalize_name(text), "")
+        return city
+
+    def match(self, text):
+        """Return `(city, exact)` for free text.
+
+        Falls back to the closest alias when there is no exact one, and to
+        `(None, False)` when nothing is close enough.
+        """
+        city = self.lookup(text)
+        if city is not None:
+            return city, True
+        name, country = _split_country(text)
+        key = normalize_name(name)
+        if not key:
+            return None, False
+        for candidate in difflib.get_close_matches(key, self._buckets.get(key[0], ()), n=5, cutoff=self.cutoff):
+            city = self._first(candidate, country)
+            if city is not None:
+                return city, False
+        return None, False
+
+
+gazetteer = Gazetteer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline city gazetteer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search = subparsers.add_parser("search", help="resolve a city name")
+    search.add_argument("query")
+    search.add_argument("--path", default=GAZETTEER_PATH, help="GeoNames-format cities file")
+    args = parser.parse_args()
+
+    index = Gazetteer(args.path)
+    index.load()
+    started = time.perf_counter()
+    city, exact = index.match(args.query)
+    elapsed = (time.perf_counter() - started) * 1000
+    if city is None:
+        print(f"No match in {len(index)} cities ({elapsed:.2f} ms)")
+    else:
+        print(f"{city.label} [{city.id}] {city.latitude}, {city.longitude} {city.timezone} "
+              f"({'exact' if exact else 'fuzzy'}, {elapsed:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,36 @@
 import asyncio
-from datetime import datetime
-from aiogram import Bot, Dispatcher, Router, BaseMiddleware
+import io
+from datetime import timedelta
+
+from aiogram import F, Router
 from aiogram.types import Message, BufferedInputFile
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
 
-from config import BOT_TOKEN, WEATHER_API_KEY
+from config import (
+    WEATHER_API_KEY, MEAL_MAX_ITEMS, MEAL_LOOKUP_CONCURRENCY, EXPORT_MAX_SIZE, CHART_DAYS, CHART_MAX_DAYS,
+    HISTORY_MAX_DAYS, ADMIN_IDS, PROFILE_SECONDS, PROFILE_MAX_SECONDS,
+)
 from logger import logger
 from external_api import get_temperature, get_food_info
-from models import *
-from states import ProfileSetup, FoodLogging, WaterLogging, WorkoutLogging, HistoryPeriod, users
+from models import (
+    UserProfile, FoodEntry, WorkoutEntry, WORKOUT_CALORIES, WATER_PER_WORKOUT, timestamp_now, get_zone,
+    local_date
+)
+from states import ProfileSetup, FoodLogging, WaterLogging, WorkoutLogging, HistoryPeriod
+from storage import storage
+from history import PERIOD_DAYS, PeriodTooLong, parse_period, format_history
+from charts import chart_data, chart_renderer
+from gazetteer import gazetteer, normalize_name
+from profiler import profiler
+from meal import parse_meal
+from export import FORMATS, iter_profile_rows, spool_rows, export_filename, StreamInputFile
+from reminders import reminders
 
 router = Router()
 
+CONFIRMATIONS = ("yes", "y")
+
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
@@ -22,9 +39,14 @@ async def cmd_start(message: Message):
         "Use the following commands:\n\n"
         "/set_profile - set up profile\n"
         "/log_water <ml> - log water consumption\n"
-        "/log_food <food> - log food consumption\n"
+        "/log_food <food [grams], ...> - log food or a whole meal\n"
         "/log_workout <type> - log workout\n"
         "/check_progress - check progress\n"
+        "/history <week|month|from to> - progress history\n"
+        "/chart [days|week|month] - progress chart\n"
+        "/export [csv|jsonl] [gz] - download your full history\n"
+        "/set_timezone <Area/City> - set your timezone\n"
+        "/reminders <on|off> - hydration reminders\n"
         "/help - commands list\n"
     )
 
@@ -34,9 +56,14 @@ async def cmd_help(message: Message):
     await message.answer(
         "/set_profile - set up profile\n"
         "/log_water <ml> - log water consumption\n"
-        "/log_food <food> - log food consumption\n"
+        "/log_food <food [grams], ...> - log food or a whole meal\n"
         "/log_workout <type> - log workout\n"
         "/check_progress - check progress\n"
+        "/history <week|month|from to> - progress history\n"
+        "/chart [days|week|month] - progress chart\n"
+        "/export [csv|jsonl] [gz] - download your full history\n"
+        "/set_timezone <Area/City> - set your timezone\n"
+        "/reminders <on|off> - hydration reminders\n"
         "/help - commands list\n"
     )
 
@@ -93,26 +120,58 @@ async def process_activity(message: Message, state: FSMContext):
 
 @router.message(ProfileSetup.city)
 async def process_city(message: Message, state: FSMContext):
-    city = message.text
+    city = (message.text or "").strip()
     user_data = await state.get_data()
+    # A close but inexact match is only a suggestion: "yes" takes it, the
+    # same name again is looked up online as typed
+    suggestion = user_data.get("suggested_city")
+    if suggestion and city.lower() in CONFIRMATIONS:
+        place = gazetteer.get(suggestion["id"])
+    elif suggestion and normalize_name(city) == suggestion["text"]:
+        place = None
+    else:
+        place, exact = gazetteer.match(city)
+        if place is not None and not exact:
+            await state.update_data(suggested_city={"id": place.id, "text": normalize_name(city)})
+            await message.answer(
+                f"Unknown city. Did you mean {place.label}?\n"
+                f"Reply yes, send {city} again to use it as typed, or send another city"
+            )
+            return
+    if suggestion:
+        await state.update_data(suggested_city=None)
     user_id = message.from_user.id
-
-    profile = UserProfile(
-        user_id=user_id,
-        weight=user_data['weight'],
-        height=user_data['height'],
-        age=user_data['age'],
-        activity_minutes=user_data['activity'],
-        city=city
-    )
+    city_name = place.name if place else city
+    city_id = place.id if place else 0
 
     try:
-        temp = await get_temperature(city, WEATHER_API_KEY)
+        # Cities missing from the gazetteer are checked against the weather API
+        temp = await get_temperature(city_name, WEATHER_API_KEY, city_id)
         if temp is None:
             raise ValueError("Failed to get temperature")
 
-        users[user_id] = profile
+        # Setting up again changes the profile but keeps its history
+        profile = await storage.get_profile(user_id)
+        is_new = profile is None
+        if is_new:
+            profile = UserProfile(user_id=user_id)
+        profile.weight = user_data['weight']
+        profile.height = user_data['height']
+        profile.age = user_data['age']
+        profile.activity_minutes = user_data['activity']
+        profile.city = city_name
+        profile.city_id = city_id
+        if place:
+            profile.timezone = place.timezone
+
+        if is_new:
+            await storage.put_profile(profile)
+        else:
+            await storage.update_profile(profile)
+        await profile.update_daily_goals(temp)
         stats = await profile.get_current_stats()
+        await storage.update_counters(user_id, stats)
+        reminders.schedule(user_id)
 
         await state.clear()
         logger.info("Profile set up for user {}", user_id)
@@ -129,6 +188,46 @@ async def process_city(message: Message, state: FSMContext):
         )
 
 
+@router.message(Command("set_timezone"))
+async def cmd_set_timezone(message: Message, command: CommandObject):
+    profile = await storage.get_profile(message.from_user.id)
+    timezone = (command.args or "").strip()
+    try:
+        valid = bool(timezone) and get_zone(timezone) is not None
+    except (KeyError, ValueError):
+        valid = False
+    if not valid:
+        await message.answer(
+            f"Current timezone: {profile.timezone or get_zone('') or 'server time'}\n"
+            "Use /set_timezone <Area/City>, for example /set_timezone Europe/Moscow"
+        )
+        return
+
+    profile.timezone = timezone
+    await storage.update_profile(profile)
+    await message.answer(f"Timezone set to {timezone}")
+
+
+@router.message(Command("reminders"))
+async def cmd_reminders(message: Message, command: CommandObject):
+    profile = await storage.get_profile(message.from_user.id)
+    choice = (command.args or "").strip().lower()
+    if choice not in ("on", "off"):
+        await message.answer(
+            f"Hydration reminders are {'on' if profile.reminders else 'off'}\n"
+            "Use /reminders on or /reminders off"
+        )
+        return
+
+    profile.reminders = choice == "on"
+    await storage.update_profile(profile)
+    if profile.reminders:
+        reminders.schedule(profile.user_id)
+    else:
+        reminders.cancel(profile.user_id)
+    await message.answer(f"Hydration reminders turned {choice}")
+
+
 @router.message(Command("log_water"))
 async def cmd_log_water(message: Message, command: CommandObject, state: FSMContext):
     if not command.args:
@@ -137,13 +236,15 @@ async def cmd_log_water(message: Message, command: CommandObject, state: FSMCont
         return
 
     user_id = message.from_user.id
-    stats = await users[user_id].get_current_stats()
+    profile = await storage.get_profile(user_id)
+    stats = await profile.get_current_stats()
 
     water_text = command.args
     
     try:
         water_amount = float(water_text)
         stats.logged_water += water_amount
+        await storage.update_counters(user_id, stats)
         remaining = stats.water_goal - stats.logged_water
         await message.answer(
             f"Logged: {water_amount} ml of water\n"
@@ -168,6 +269,11 @@ async def cmd_log_food(message: Message, command: CommandObject, state: FSMConte
         )
         return
 
+    items = parse_meal(command.args)
+    if len(items) > 1 or items and items[0].weight is not None:
+        await log_meal(message, state, items[:MEAL_MAX_ITEMS], skipped=items[MEAL_MAX_ITEMS:])
+        return
+
     food_info = await get_food_info(command.args)
 
     if not food_info:
@@ -187,7 +293,8 @@ async def cmd_log_food(message: Message, command: CommandObject, state: FSMConte
     try:
         await state.update_data(
             food_name=food_info["name"],
-            calories_per_100=float(food_info["calories"])
+            calories_per_100=float(food_info["calories"]),
+            pending_foods=[]
         )
         await state.set_state(FoodLogging.waiting_for_weight)
         await message.answer(
@@ -203,6 +310,66 @@ async def cmd_log_food(message: Message, command: CommandObject, state: FSMConte
         )
 
 
+async def lookup_foods(names):
+    """Look up several foods concurrently, at most MEAL_LOOKUP_CONCURRENCY at a time."""
+    semaphore = asyncio.Semaphore(MEAL_LOOKUP_CONCURRENCY)
+
+    async def lookup(name):
+        async with semaphore:
+            return await get_food_info(name)
+
+    results = await asyncio.gather(*(lookup(name) for name in names), return_exceptions=True)
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logger.error("Food lookup failed for {}: {}", name, result)
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+async def log_meal(message, state, items, skipped=()):
+    """Log every item of a meal in one step and ask only for missing weights.
+
+    `skipped` are the items beyond MEAL_MAX_ITEMS, reported back unlogged.
+    """
+    infos = await lookup_foods([item.name for item in items])
+
+    entries, missing_weight, not_found = [], [], []
+    now = timestamp_now()
+    for item, info in zip(items, infos):
+        if not info or info.get("error") or info.get("calories") is None:
+            not_found.append(item.name)
+        elif item.weight is None:
+            missing_weight.append([info["name"], float(info["calories"])])
+        else:
+            calories = float(info["calories"]) * item.weight / 100
+            entries.append(FoodEntry(name=info["name"], weight=item.weight, calories=calories, timestamp=now))
+
+    lines = []
+    if entries:
+        user_id = message.from_user.id
+        profile = await storage.get_profile(user_id)
+        stats = await profile.get_current_stats()
+        stats.logged_calories += sum(entry.calories for entry in entries)
+        await storage.append_foods(user_id, stats, entries)
+
+        lines.append("Logged:")
+        lines.extend(f"- {entry.name}: {entry.weight:g} g, {entry.calories:.1f} kcal" for entry in entries)
+        lines.append(f"Total: {sum(entry.calories for entry in entries):.1f} kcal")
+    if not_found:
+        lines.append("Couldn't find: " + ", ".join(not_found))
+    if skipped:
+        lines.append(
+            f"Only the first {MEAL_MAX_ITEMS} items were processed, send these again: "
+            + ", ".join(item.name for item in skipped)
+        )
+
+    if missing_weight:
+        (food_name, calories_per_100), *pending = missing_weight
+        await state.update_data(food_name=food_name, calories_per_100=calories_per_100, pending_foods=pending)
+        await state.set_state(FoodLogging.waiting_for_weight)
+        lines.append(f"How many grams of {food_name} did you eat?")
+    await message.answer("\n".join(lines))
+
+
 @router.message(FoodLogging.waiting_for_food_name)
 async def process_food_name(message: Message, state: FSMContext):
     await state.clear()
@@ -217,21 +384,29 @@ async def process_food_weight(message: Message, state: FSMContext):
         calories = food_data['calories_per_100'] * weight / 100
 
         user_id = message.from_user.id
-        stats = await users[user_id].get_current_stats()
+        profile = await storage.get_profile(user_id)
+        stats = await profile.get_current_stats()
         stats.logged_calories += calories
-        stats.food_log.append({
-            "name": food_data['food_name'],
-            "weight": weight,
-            "calories": calories,
-            "timestamp": datetime.now().isoformat()
-        })
+        await storage.append_food(user_id, stats, FoodEntry(
+            name=food_data['food_name'],
+            weight=weight,
+            calories=calories,
+            timestamp=timestamp_now()
+        ))
 
-        await state.clear()
         await message.answer(
             f"Logged: {food_data['food_name']}\n"
             f"- Weight: {weight} g\n"
             f"- Calories: {calories:.1f} kcal"
         )
+
+        pending = food_data.get('pending_foods')
+        if pending:
+            (food_name, calories_per_100), *pending = pending
+            await state.update_data(food_name=food_name, calories_per_100=calories_per_100, pending_foods=pending)
+            await message.answer(f"How many grams of {food_name} did you eat?")
+        else:
+            await state.clear()
     except ValueError:
         await message.answer("Please enter the weight in grams as a number.")
 
@@ -295,7 +470,8 @@ async def cmd_log_workout(message: Message, command: CommandObject, state: FSMCo
         return
 
     user_id = message.from_user.id
-    stats = await users[user_id].get_current_stats()
+    profile = await storage.get_profile(user_id)
+    stats = await profile.get_current_stats()
     workout_type = state_data['workout_type']
     workout_duration = state_data['workout_duration']
 
@@ -304,12 +480,12 @@ async def cmd_log_workout(message: Message, command: CommandObject, state: FSMCo
         water_needed = (workout_duration // 30) * WATER_PER_WORKOUT
 
         stats.burned_calories += calories_burned
-        stats.workout_log.append({
-            "type": workout_type,
-            "duration": workout_duration,
-            "calories": calories_burned,
-            "timestamp": datetime.now().isoformat()
-        })
+        await storage.append_workout(user_id, stats, WorkoutEntry(
+            type=workout_type,
+            duration=workout_duration,
+            calories=calories_burned,
+            timestamp=timestamp_now()
+        ))
         await state.clear()
         await message.answer(
             f"Logged:{workout_type.capitalize()} {workout_duration} minutes\n"
@@ -325,12 +501,13 @@ async def cmd_log_workout(message: Message, command: CommandObject, state: FSMCo
 @router.message(Command("check_progress"))
 async def cmd_check_progress(message: Message):
     user_id = message.from_user.id
-    user = users[user_id]
+    user = await storage.get_profile(user_id)
     stats = await user.get_current_stats()
 
-    temp = await get_temperature(user.city, WEATHER_API_KEY)
+    temp = await get_temperature(user.city, WEATHER_API_KEY, user.city_id)
     if temp is not None:
         await user.update_daily_goals(temp)
+        await storage.update_counters(user_id, stats)
 
         if abs(temp - stats.temperature) > 5:
             temp_diff = "increased" if temp > stats.temperature else "decreased"
@@ -351,3 +528,124 @@ async def cmd_check_progress(message: Message):
         f"{stats.logged_calories - stats.calorie_goal - stats.burned_calories} kcal.\n\n"
         f"Good job! Keep going!:\n"
     )
+
+
+@router.message(Command("chart"))
+async def cmd_chart(message: Message, command: CommandObject):
+    profile = await storage.get_profile(message.from_user.id)
+    period = (command.args or "").strip().lower()
+    try:
+        days = PERIOD_DAYS[period] if period in PERIOD_DAYS else int(period or CHART_DAYS)
+        if not 2 <= days <= CHART_MAX_DAYS:
+            raise ValueError(period)
+    except ValueError:
+        await message.answer(f"Use /chart, /chart week, /chart month or /chart <days> (2-{CHART_MAX_DAYS})")
+        return
+
+    today = local_date(profile.timezone)
+    data = chart_data(profile, today - timedelta(days=days - 1), today)
+    try:
+        key, png, file_id = await chart_renderer.render(data)
+    except Exception as e:
+        logger.error("Chart rendering failed for user {}: {}", message.from_user.id, e)
+        await message.answer("Couldn't draw the chart right now. Please try again later")
+        return
+    sent = await message.answer_photo(file_id or BufferedInputFile(png, filename="progress.png"))
+    if file_id is None and sent.photo:
+        chart_renderer.cache.set_file_id(key, sent.photo[-1].file_id)
+
+
+@router.message(Command("history"))
+async def cmd_history(message: Message, command: CommandObject, state: FSMContext):
+    if not command.args:
+        await state.set_state(HistoryPeriod.waiting_for_period)
+        await message.answer(
+            "Choose the period: week, month or a custom range "
+            "in format YYYY-MM-DD YYYY-MM-DD"
+        )
+        return
+
+    profile = await storage.get_profile(message.from_user.id)
+    try:
+        start, end = parse_period(command.args, local_date(profile.timezone))
+    except PeriodTooLong:
+        await message.answer(f"The period is too long, choose at most {HISTORY_MAX_DAYS} days")
+        return
+    except ValueError:
+        await message.answer(
+            "Unknown period.\n"
+            "Use week, month or a custom range in format YYYY-MM-DD YYYY-MM-DD"
+        )
+        return
+
+    await message.answer(format_history(profile, start, end))
+
+
+@router.message(HistoryPeriod.waiting_for_period)
+async def process_history_period(message: Message, state: FSMContext):
+    await state.clear()
+    await cmd_history(message, CommandObject(prefix="/", command="history", args=message.text), state)
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    options = (command.args or "").lower().split()
+    fmt = next((option for option in options if option in FORMATS), "csv")
+    compress = "gz" in options or "gzip" in options
+
+    profile = await storage.get_profile(message.from_user.id)
+    rows = iter_profile_rows(profile)
+    spool = await asyncio.to_thread(spool_rows, rows, fmt, compress)
+    try:
+        size = spool.seek(0, io.SEEK_END)
+        if size > EXPORT_MAX_SIZE:
+            await message.answer("Your history is too large to send. Try /export jsonl gz")
+            return
+        filename = export_filename(profile.user_id, local_date(profile.timezone), fmt, compress)
+        await message.answer_document(StreamInputFile(spool, filename), caption="Your history")
+    finally:
+        spool.close()
+
+
+_profile_tasks = set()
+
+
+@router.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_profile(message: Message, command: CommandObject):
+    try:
+        seconds = float(command.args or PROFILE_SECONDS)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(seconds)
+    except ValueError:
+        await message.answer(f"Use /profile [seconds], at most {PROFILE_MAX_SECONDS:.0f}")
+        return
+    if profiler.running or _profile_tasks:
+        await message.answer("A profile is already running")
+        return
+
+    await message.answer(f"Profiling for {seconds:g}s")
+    # The profile runs outside the handler, so the admin's other messages
+    # are not queued behind it
+    task = asyncio.create_task(_send_profile(message, seconds))
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+
+
+async def _send_profile(message: Message, seconds: float):
+    try:
+        try:
+            profile = await profiler.run(seconds)
+        except RuntimeError:
+            await message.answer("A profile is already running")
+            return
+        name = f"profile_{timestamp_now()}"
+        await message.answer_document(
+            BufferedInputFile(profile.collapsed().encode("utf-8"), filename=f"{name}.collapsed"),
+            caption=profile.summary()[:1024],
+        )
+        if profile.stalls:
+            await message.answer_document(
+                BufferedInputFile(profile.stalls_report().encode("utf-8"), filename=f"{name}.stalls.txt")
+            )
+    except Exception as e:
+        logger.error("Failed to send a profile: {}", e)
@@ -0,0 +1,133 @@
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+from config import HISTORY_MAX_DAYS
+
+# NumPy and pandas are imported inside the functions that use them so that
+# they do not slow down bot startup. `/history` itself is answered from the
+# running totals in aggregates.py; `aggregate_history` recomputes the same
+# numbers from the stored days.
+
+PERIOD_DAYS = {
+    "week": 7,
+    "month": 30,
+}
+
+MAX_DAILY_ROWS = 14
+
+COLUMNS = ("water", "water_goal", "consumed", "calorie_goal", "burned")
+
+
+class PeriodTooLong(ValueError):
+    pass
+
+
+def parse_period(text, today=None, max_days=HISTORY_MAX_DAYS):
+    """Return an inclusive (start, end) date range for a period argument.
+
+    Accepts "week", "month" or a custom range "YYYY-MM-DD YYYY-MM-DD" of at
+    most `max_days` days. Raises PeriodTooLong for longer ranges and
+    ValueError for anything else.
+    """
+    today = today or date.today()
+    text = (text or "").strip().lower()
+    if text in PERIOD_DAYS:
+        return today - timedelta(days=PERIOD_DAYS[text] - 1), today
+
+    parts = text.replace("..", " ").split()
+    if len(parts) != 2:
+        raise ValueError(f"Unknown period: {text}")
+    start, end = date.fromisoformat(parts[0]), date.fromisoformat(parts[1])
+    if start > end:
+        start, end = end, start
+    if (end - start).days + 1 > max_days:
+        raise PeriodTooLong(f"Period longer than {max_days} days: {text}")
+    return start, end
+
+
+def stats_frame(profile, start, end):
+    """Columnar view of `profile.daily_stats` between `start` and `end`.
+
+    ISO dates sort lexicographically, so the window is located by bisection
+    and only the days inside it are read. Days without stats are filled
+    with zeros for logged values and NaN for goals.
+    """
+    import numpy as np
+    import pandas as pd
+
+    days = sorted(profile.daily_stats)
+    lo = bisect_left(days, start.isoformat())
+    hi = bisect_right(days, end.isoformat())
+    window = [profile.daily_stats[day] for day in days[lo:hi]]
+    count = len(window)
+
+    frame = pd.DataFrame(
+        {
+            "water": np.fromiter((s.logged_water for s in window), np.float64, count),
+            "water_goal": np.fromiter((s.water_goal for s in window), np.float64, count),
+            "consumed": np.fromiter((s.logged_calories for s in window), np.float64, count),
+            "calorie_goal": np.fromiter((s.calorie_goal for s in window), np.float64, count),
+            "burned": np.fromiter((s.burned_calories for s in window), np.float64, count),
+        },
+        index=pd.DatetimeIndex(np.array(days[lo:hi], dtype="datetime64[D]")),
+        columns=list(COLUMNS),
+    )
+    frame = frame.reindex(pd.date_range(start, end, freq="D"))
+    frame[["water", "consumed", "burned"]] = frame[["water", "consumed", "burned"]].fillna(0)
+    return frame
+
+
+def aggregate_history(profile, start, end):
+    """Per-day water, consumed, burned and balance plus period totals,
+    recomputed from `profile.daily_stats`."""
+    frame = stats_frame(profile, start, end)
+    frame["balance"] = frame["consumed"] - frame["calorie_goal"].fillna(0) - frame["burned"]
+    active = frame["calorie_goal"].notna().to_numpy()
+
+    totals = frame[["water", "consumed", "burned", "balance"]].sum()
+    averages = frame.loc[active, ["water", "consumed", "burned", "balance"]].mean()
+    return frame, totals, averages, int(active.sum())
+
+
+def format_history(profile, start, end):
+    """Daily rows for short periods plus totals and averages.
+
+    Totals come from the profile's running totals, so their cost does not
+    depend on the length of the period or of the stored history.
+    """
+    totals = profile.totals.range(start, end)
+
+    lines = [f"History {start.isoformat()} - {end.isoformat()}:"]
+    days = (end - start).days + 1
+    if days <= MAX_DAILY_ROWS:
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            stats = profile.daily_stats.get(day.isoformat())
+            if stats is None:
+                lines.append(f"{day:%d.%m}: no data")
+                continue
+            balance = stats.logged_calories - stats.calorie_goal - stats.burned_calories
+            lines.append(
+                f"{day:%d.%m}: water {stats.logged_water:.0f}/{stats.water_goal:.0f} ml, "
+                f"consumed {stats.logged_calories:.0f} kcal, burned {stats.burned_calories:.0f} kcal, "
+                f"balance {balance:.0f} kcal"
+            )
+        lines.append("")
+
+    if not totals.days:
+        lines.append("No data for this period.")
+        return "\n".join(lines)
+
+    lines.append(
+        f"Totals ({totals.days} active days):\n"
+        f"- Water: {totals.water:.0f} ml\n"
+        f"- Consumed: {totals.consumed:.0f} kcal\n"
+        f"- Burned: {totals.burned:.0f} kcal\n"
+        f"- Balance: {totals.balance:.0f} kcal\n\n"
+        f"Daily averages:\n"
+        f"- Water: {totals.average('water'):.0f} ml\n"
+        f"- Consumed: {totals.average('consumed'):.0f} kcal\n"
+        f"- Burned: {totals.average('burned'):.0f} kcal\n"
+        f"- Balance: {totals.average('balance'):.0f} kcal"
+    )
+    return "\n".join(lines)
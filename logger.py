@@ -1,7 +1,9 @@
 import logging
+import multiprocessing
+import queue
 import sys
+import threading
 from loguru import logger as loggeru
-import streamlit
 import os
 from pathlib import Path
 from typing import Final
@@ -10,6 +12,12 @@ from typing import Final
 LOG_LEVEL: Final[str] = os.getenv("LOG_LEVEL", "INFO")
 LOG_RETENTION_DAYS: Final[str] = os.getenv("LOG_RETENTION_DAYS", "30 days")
 LOG_ROTATION_SIZE: Final[str] = os.getenv("LOG_ROTATION_SIZE", "100 MB")
+LOG_QUEUED: Final[bool] = os.getenv("LOG_QUEUED", "true").lower() in ("1", "true", "yes")
+LOG_JSON: Final[bool] = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+LOG_BATCH_SIZE: Final[int] = int(os.getenv("LOG_BATCH_SIZE", 256))
+LOG_FLUSH_INTERVAL: Final[float] = float(os.getenv("LOG_FLUSH_INTERVAL", 0.2))
+LOG_MESSAGE_LEVEL: Final[str] = os.getenv("LOG_MESSAGE_LEVEL", "INFO")
+LOG_MESSAGE_SAMPLE_RATE: Final[float] = float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", 1.0))
 
 PROJECT_ROOT: Final[Path] = Path(__file__).parent
 LOG_DIR: Final[Path] = PROJECT_ROOT / "logs"
@@ -53,31 +61,132 @@ class InterceptHandler(logging.Handler):
         ).log(level, record.getMessage())
 
 
+class QueuedWriter:
+    """Stream for the single loguru sink used in queued mode.
+
+    The calling thread formats the record once and puts it on a queue. A
+    background thread drains up to `batch_size` records at a time, writes
+    them to the stream with one call and hands the same batch to the file
+    sinks as a raw message, so file writes, rotation and zip compression
+    all happen off the event loop.
+
+    There is deliberately no `flush` method: loguru would call it after
+    every record.
+    """
+
+    def __init__(self, stream, batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self._stream = stream
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._stopped = object()
+        self._error_level = loggeru.level("ERROR").no
+        self._files = loggeru.bind(log_file="app").opt(raw=True)
+        self._errors = loggeru.bind(log_file="errors").opt(raw=True)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        self._queue.put(message)
+
+    def _drain(self):
+        try:
+            record = self._queue.get(timeout=self._flush_interval)
+        except queue.Empty:
+            return [], False
+
+        batch = []
+        while True:
+            if record is self._stopped:
+                return batch, True
+            batch.append(record)
+            if len(batch) >= self._batch_size:
+                return batch, False
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+    def _write(self, batch):
+        text = "".join(batch)
+        self._stream.write(text)
+        self._stream.flush()
+        self._files.log("TRACE", text)
+
+        errors = "".join(message for message in batch if message.record["level"].no >= self._error_level)
+        if errors:
+            self._errors.log("TRACE", errors)
+
+    def _run(self):
+        while True:
+            batch, stop = self._drain()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    sys.stderr.write(f"Log writer failed: {e}\n")
+            if stop:
+                return
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._queue.put(self._stopped)
+            self._thread.join()
+
+
 class CustomizeLogger:
 
     @classmethod
-    def make_logger(cls, logger_name: str):
+    def make_logger(cls, logger_name: str, queued: bool = LOG_QUEUED, json_format: bool = LOG_JSON,
+                    log_dir: Path = LOG_DIR, stream=sys.stdout):
+        """Configure loguru sinks.
+
+        In queued mode records are formatted once by a single sink and
+        written by QueuedWriter; the file sinks only accept the raw batches
+        it forwards. stdout output is not colorized in this mode.
+        """
         loggeru.remove()
 
+        # Worker processes (chart rendering) import the main module again;
+        # they must not start another writer on the parent's log files.
+        # parent_process() is only set once that import is done.
+        if multiprocessing.parent_process() is not None or multiprocessing.current_process().name != "MainProcess":
+            loggeru.add(stream, format=LOG_FORMAT, level="WARNING", colorize=False)
+            return loggeru.bind(request_id=None, method=None)
+
+        if queued:
+            cls._add_queued_sinks(logger_name, json_format, log_dir, stream)
+        else:
+            cls._add_sinks(logger_name, json_format, log_dir, stream)
+
+        logging.basicConfig(handlers=[InterceptHandler()], level=0)
+        
+
+        return loggeru.bind(request_id=None, method=None)
+
+    @staticmethod
+    def _add_sinks(logger_name, json_format, log_dir, stream):
         loggeru.add(
-            sys.stdout,
+            stream,
             format=LOG_FORMAT,
             level=LOG_LEVEL,
-            colorize=True
+            colorize=not json_format,
+            serialize=json_format
         )
 
         loggeru.add(
-            LOG_DIR / logger_name / "app.log",
+            log_dir / logger_name / "app.log",
             format=LOG_FORMAT,
             level=LOG_LEVEL,
             rotation=LOG_ROTATION_SIZE,
             retention=LOG_RETENTION_DAYS,
             compression="zip",
-            encoding="utf-8"
+            encoding="utf-8",
+            serialize=json_format
         )
 
         loggeru.add(
-            LOG_DIR / logger_name / "errors.log",
+            log_dir / logger_name / "errors.log",
             format=LOG_FORMAT,
             level="ERROR",
             rotation="1 week",
@@ -85,12 +194,41 @@ class CustomizeLogger:
             compression="zip",
             encoding="utf-8",
             backtrace=True,
-            diagnose=True
+            diagnose=True,
+            serialize=json_format
         )
 
-        logging.basicConfig(handlers=[InterceptHandler()], level=0)
-        
+    @staticmethod
+    def _add_queued_sinks(logger_name, json_format, log_dir, stream):
+        is_forwarded = lambda record: "log_file" in record["extra"]
 
-        return loggeru.bind(request_id=None, method=None)
+        loggeru.add(
+            QueuedWriter(stream),
+            format=LOG_FORMAT,
+            level=LOG_LEVEL,
+            colorize=False,
+            serialize=json_format,
+            filter=lambda record: not is_forwarded(record)
+        )
+
+        loggeru.add(
+            log_dir / logger_name / "app.log",
+            level="TRACE",
+            rotation=LOG_ROTATION_SIZE,
+            retention=LOG_RETENTION_DAYS,
+            compression="zip",
+            encoding="utf-8",
+            filter=lambda record: record["extra"].get("log_file") == "app"
+        )
+
+        loggeru.add(
+            log_dir / logger_name / "errors.log",
+            level="TRACE",
+            rotation="1 week",
+            retention=LOG_RETENTION_DAYS,
+            compression="zip",
+            encoding="utf-8",
+            filter=lambda record: record["extra"].get("log_file") == "errors"
+        )
 
 logger = CustomizeLogger.make_logger("tg-bot")
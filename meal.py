@@ -0,0 +1,32 @@
+import re
+from typing import NamedTuple, Optional
+
+# Items are separated by ";", new lines or commas that are not decimal commas
+ITEM_SEPARATOR = re.compile(r"[;\n]|,(?!\d)")
+ITEM = re.compile(r"^(?P<name>.+?)\s+(?P<amount>\d+(?:[.,]\d+)?)\s*(?P<unit>g|gr|grams?|kg)?\.?$", re.IGNORECASE)
+
+
+class MealItem(NamedTuple):
+    name: str
+    weight: Optional[float]
+
+
+def parse_meal(text):
+    """Split "apple 150g, bread 80g, cheese" into items.
+
+    The weight is in grams and is None when an item has no amount.
+    """
+    items = []
+    for part in ITEM_SEPARATOR.split(text or ""):
+        part = " ".join(part.split())
+        if not part:
+            continue
+        match = ITEM.match(part)
+        if match is None:
+            items.append(MealItem(part, None))
+            continue
+        weight = float(match["amount"].replace(",", "."))
+        if (match["unit"] or "").lower() == "kg":
+            weight *= 1000
+        items.append(MealItem(match["name"], weight))
+    return items
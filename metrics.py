@@ -0,0 +1,196 @@
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+from logger import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    """Counter incremented explicitly or read from `callback` at scrape time."""
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        if self.callback is not None:
+            yield self.name, "", self.callback()
+            return
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (
+                    self.name + "_bucket",
+                    _format_labels(self.labelnames, labels, [("le", le)]),
+                    cumulative,
+                )
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), total
+            yield self.name + "_count", _format_labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.histogram(
+    "bot_handler_seconds", "Message handler latency", ["handler"]
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Unhandled exceptions raised by message handlers", ["handler", "error"]
+)
+fsm_transitions = registry.counter(
+    "bot_fsm_transitions_total", "FSM state transitions", ["from_state", "to_state"]
+)
+upstream_latency = registry.histogram(
+    "bot_upstream_seconds", "External API request latency", ["upstream", "status"]
+)
+
+
+def observe_upstream(upstream, status, started):
+    upstream_latency.observe(time.perf_counter() - started, upstream, str(status))
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Records handler latency, errors and FSM transitions per handler."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        state = data.get("state")
+        before = data.get("raw_state")
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+            if state is not None:
+                after = await state.get_state()
+                if after != before:
+                    fsm_transitions.inc(before or "none", after or "none")
+
+
+class MetricsServer:
+    """Serves `GET /metrics` on a local port from the bot process."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def handle(self, request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error("Unable to start metrics server: {}", e)
+            await self.close()
+            return
+        logger.info("Metrics available at http://{}:{}/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics_server = MetricsServer()
@@ -1,8 +1,36 @@
+import asyncio
+import random
+import time
+
 from aiogram import BaseMiddleware
-from states import users
-from logger import logger
+from aiogram.dispatcher.event.bases import UNHANDLED
+from config import (
+    HANDLER_DEADLINE, USER_QUEUE_SIZE, ADMISSION_LIMITS, ADMISSION_GLOBAL_RATE, ADMISSION_GLOBAL_BURST,
+    ADMISSION_COALESCE_WINDOW, ADMISSION_NOTICE_INTERVAL,
+)
+from storage import storage
+from logger import logger, LOG_LEVEL, LOG_MESSAGE_LEVEL, LOG_MESSAGE_SAMPLE_RATE
+from metrics import registry
+from outbound import outbound_priority, BACKGROUND
+from resilience import deadline, TokenBucket
 from states import ProfileSetup
 
+update_queue_depth = registry.gauge(
+    "bot_update_queue_depth", "Updates waiting for an earlier update of the same user"
+)
+update_lanes = registry.gauge(
+    "bot_update_lanes", "Users with updates being handled or waiting"
+)
+dropped_updates = registry.counter(
+    "bot_dropped_updates_total", "Updates dropped because the user's queue was full"
+)
+shed_updates = registry.counter(
+    "bot_admission_dropped_total", "Messages shed by admission control", ["reason"]
+)
+merged_updates = registry.counter(
+    "bot_admission_merged_total", "Repeated identical commands merged into an earlier one"
+)
+
 
 class CheckCommandMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
@@ -18,7 +46,7 @@ class CheckCommandMiddleware(BaseMiddleware):
 
             return await handler(event, data)
 
-        if user_id not in users:
+        if not await storage.has_profile(user_id):
             await event.answer("Set up your profile for using bot")
             return
 
@@ -26,6 +54,200 @@ class CheckCommandMiddleware(BaseMiddleware):
 
 
 class LoggingMiddleware(BaseMiddleware):
+    def __init__(self, level=LOG_MESSAGE_LEVEL, sample_rate=LOG_MESSAGE_SAMPLE_RATE):
+        self.level = level
+        self.sample_rate = sample_rate
+        # Decide once whether message logs can reach any sink at all
+        self.enabled = sample_rate > 0 and logger.level(level).no >= logger.level(LOG_LEVEL).no
+
+    async def __call__(self, handler, event, data):
+        if self.enabled and (self.sample_rate >= 1 or random.random() < self.sample_rate):
+            logger.log(self.level, "Message from user {} with text: {}", event.from_user.id, event.text)
+        return await handler(event, data)
+
+
+class DeadlineMiddleware(BaseMiddleware):
+    """Gives each handler a time budget for the upstream requests it makes."""
+
+    def __init__(self, budget=HANDLER_DEADLINE):
+        self.budget = budget
+
+    async def __call__(self, handler, event, data):
+        with deadline(self.budget):
+            return await handler(event, data)
+
+
+class _Lane:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class UserLaneMiddleware(BaseMiddleware):
+    """Handles the updates of each user one at a time, in arrival order.
+
+    Registered as an outer update middleware: updates of different users
+    still run concurrently. A user may have at most `max_pending` updates
+    in progress or waiting; further ones are dropped. A lane is removed as
+    soon as it is empty, so idle users cost nothing.
+    """
+
+    def __init__(self, max_pending=USER_QUEUE_SIZE):
+        self.max_pending = max_pending
+        self._lanes = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        lane = self._lanes.get(user.id)
+        if lane is None:
+            lane = self._lanes[user.id] = _Lane()
+            update_lanes.inc()
+        elif lane.pending >= self.max_pending:
+            dropped_updates.inc()
+            logger.warning("Dropping update {} of user {}: queue is full", event.update_id, user.id)
+            return UNHANDLED
+
+        lane.pending += 1
+        update_queue_depth.inc()
+        try:
+            try:
+                await lane.lock.acquire()
+            finally:
+                update_queue_depth.dec()
+            try:
+                return await handler(event, data)
+            finally:
+                lane.lock.release()
+        finally:
+            lane.pending -= 1
+            if not lane.pending:
+                del self._lanes[user.id]
+                update_lanes.dec()
+
+
+def parse_limits(spec):
+    """Parse "<command>=<rate>/<burst>,..." into {command: (rate, burst)}."""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            command, limit = item.split("=")
+            rate, burst = limit.split("/")
+            limits[command.strip().lower()] = (float(rate), int(burst))
+        except ValueError:
+            raise ValueError(f"Invalid admission limit: {item!r}") from None
+    if "*" not in limits:
+        raise ValueError("Admission limits need a default \"*\" entry")
+    return limits
+
+
+class _Visitor:
+    __slots__ = ("buckets", "last_text", "last_at", "noticed_at", "seen_at")
+
+    def __init__(self):
+        self.buckets = {}
+        self.last_text = None
+        self.last_at = 0.0
+        self.noticed_at = 0.0
+        self.seen_at = 0.0
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """Sheds messages beyond per-user and global rate limits.
+
+    Registered as the first outer update middleware, so rejected messages
+    cost neither a place in the user's lane nor a storage lookup. Each user
+    has a token bucket per command listed in `limits` and one shared by all
+    other messages; a global bucket caps the total. A command repeating the
+    user's previous message within `coalesce_window` seconds is merged into
+    it, since the first one is answered anyway. Shed messages get a short
+    notice at most once per `notice_interval` seconds per user, sent at
+    background priority.
+    """
+
+    def __init__(self, limits=ADMISSION_LIMITS, global_rate=ADMISSION_GLOBAL_RATE,
+                 global_burst=ADMISSION_GLOBAL_BURST, coalesce_window=ADMISSION_COALESCE_WINDOW,
+                 notice_interval=ADMISSION_NOTICE_INTERVAL, max_visitors=10000):
+        self.limits = parse_limits(limits) if isinstance(limits, str) else limits
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.coalesce_window = coalesce_window
+        self.notice_interval = notice_interval
+        self.max_visitors = max_visitors
+        # A visitor idle this long has full buckets and nothing to merge
+        self.idle_after = max(
+            [burst / rate for rate, burst in self.limits.values()] + [coalesce_window, notice_interval]
+        )
+        self._visitors = {}
+        self._pruned_at = 0.0
+        self._notices = set()
+
+    def _command(self, text):
+        if not text.startswith("/"):
+            return "*"
+        command = text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+        return command if command in self.limits else "*"
+
+    def _visitor(self, user_id, now):
+        visitor = self._visitors.get(user_id)
+        if visitor is None:
+            if len(self._visitors) >= self.max_visitors and now - self._pruned_at > 1:
+                self._pruned_at = now
+                self._visitors = {
+                    key: value for key, value in self._visitors.items() if now - value.seen_at < self.idle_after
+                }
+            visitor = self._visitors[user_id] = _Visitor()
+        visitor.seen_at = now
+        return visitor
+
     async def __call__(self, handler, event, data):
-        logger.info("Message from user {} with text: {}", event.from_user.id, event.text)
-        return await handler(event, data)
\ No newline at end of file
+        message = event.message
+        user = data.get("event_from_user")
+        if message is None or user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        visitor = self._visitor(user.id, now)
+        text = message.text or ""
+        command = self._command(text)
+
+        if text.startswith("/") and text == visitor.last_text and now - visitor.last_at < self.coalesce_window:
+            merged_updates.inc()
+            return UNHANDLED
+
+        bucket = visitor.buckets.get(command)
+        if bucket is None:
+            bucket = visitor.buckets[command] = TokenBucket(*self.limits[command])
+        if not await bucket.acquire(timeout=0):
+            return self._shed(message, visitor, now, "user_limit")
+        if not await self.global_bucket.acquire(timeout=0):
+            # The message is dropped, so it must not count against the user
+            bucket.release()
+            return self._shed(message, visitor, now, "global_limit")
+        # Only a message that is handled can absorb its repeats
+        visitor.last_text, visitor.last_at = text, now
+        return await handler(event, data)
+
+    def _shed(self, message, visitor, now, reason):
+        shed_updates.inc(reason)
+        if now - visitor.noticed_at >= self.notice_interval:
+            visitor.noticed_at = now
+            # Sent in the background, so a slow send does not hold up polling
+            task = asyncio.create_task(self._notify(message))
+            self._notices.add(task)
+            task.add_done_callback(self._notices.discard)
+        return UNHANDLED
+
+    @staticmethod
+    async def _notify(message):
+        # The task runs in a copy of the context, so this stays local to it
+        outbound_priority.set(BACKGROUND)
+        try:
+            await message.answer("Too many messages, please slow down and try again in a moment")
+        except Exception as e:
+            logger.warning("Failed to send a rate limit notice: {}", e)
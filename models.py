@@ -1,14 +1,21 @@
+import struct
+import sys
+import time
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Dict, List
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional
+from zoneinfo import ZoneInfo
 
+from aggregates import RollingTotals
 from external_api import get_temperature
-from config import WEATHER_API_KEY
+from config import WEATHER_API_KEY, DEFAULT_TIMEZONE
 
 WATER_PER_KG = 30
 WATER_PER_ACTIVITY = 500
 WATER_PER_WORKOUT = 200
 WATER_HOT_WEATHER = 500
+DEFAULT_TEMPERATURE = 20
 
 WORKOUT_CALORIES = {
     "run": 10,
@@ -18,7 +25,103 @@ WORKOUT_CALORIES = {
     "football": 12,
 }
 
-@dataclass
+class FoodEntry(NamedTuple):
+    name: str
+    weight: float
+    calories: float
+    timestamp: int
+
+
+class WorkoutEntry(NamedTuple):
+    type: str
+    duration: float
+    calories: float
+    timestamp: int
+
+
+# float32 amount and calories, epoch-seconds timestamp, name length
+_ENTRY = struct.Struct("<ffqH")
+
+
+class EntryLog:
+    """Append-only log of entries packed into a single bytearray.
+
+    Each entry takes 18 bytes, float32 amount and calories, an epoch-seconds
+    timestamp and the length of the name, followed by the name in UTF-8.
+    Names live only in the log, so memory is released with the day. The
+    buffer is allocated on the first append, so an empty day costs a single
+    small object. Iterating yields `entry_type` tuples.
+    """
+    __slots__ = ("_data",)
+    entry_type = None
+
+    def __init__(self, entries=()):
+        self._data = None
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        name, amount, calories, timestamp = entry
+        encoded = name.encode()[:0xFFFF]
+        if self._data is None:
+            self._data = bytearray()
+        self._data += _ENTRY.pack(amount, calories, int(timestamp), len(encoded))
+        self._data += encoded
+
+    def _entries(self):
+        data = bytes(self._data or b"")
+        offset = 0
+        while offset < len(data):
+            amount, calories, timestamp, size = _ENTRY.unpack_from(data, offset)
+            offset += _ENTRY.size
+            name = data[offset:offset + size].decode(errors="replace")
+            offset += size
+            yield self.entry_type(name, amount, calories, timestamp)
+
+    def __len__(self):
+        return sum(1 for _ in self._entries()) if self._data else 0
+
+    def __getitem__(self, index):
+        entries = list(self._entries())
+        try:
+            return entries[index]
+        except IndexError:
+            raise IndexError("log index out of range") from None
+
+    def __iter__(self):
+        return self._entries()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class FoodLog(EntryLog):
+    __slots__ = ()
+    entry_type = FoodEntry
+
+
+class WorkoutLog(EntryLog):
+    __slots__ = ()
+    entry_type = WorkoutEntry
+
+
+def timestamp_now():
+    return int(time.time())
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """ZoneInfo for an IANA name, falling back to DEFAULT_TIMEZONE and then
+    to the server's local time (None). Raises for unknown names."""
+    name = name or DEFAULT_TIMEZONE
+    return ZoneInfo(name) if name else None
+
+
+def local_date(timezone="", now=None) -> date:
+    return datetime.fromtimestamp(time.time() if now is None else now, get_zone(timezone)).date()
+
+
+@dataclass(slots=True)
 class DailyStats:
     date: str
     logged_water: float = 0
@@ -27,11 +130,14 @@ class DailyStats:
     water_goal: float = 0
     calorie_goal: float = 0
     temperature: float = 0
-    food_log: List[Dict] = field(default_factory=list)
-    workout_log: List[Dict] = field(default_factory=list)
+    food_log: FoodLog = field(default_factory=FoodLog)
+    workout_log: WorkoutLog = field(default_factory=WorkoutLog)
 
+    def __post_init__(self):
+        self.date = sys.intern(self.date)
 
-@dataclass
+
+@dataclass(slots=True)
 class UserProfile:
     user_id: int
     weight: float = 0
@@ -39,21 +145,38 @@ class UserProfile:
     age: int = 0
     activity_minutes: int = 0
     city: str = ""
+    city_id: int = 0
+    timezone: str = ""
+    reminders: bool = True
     daily_stats: Dict[str, DailyStats] = field(default_factory=dict)
+    rolling: Optional[RollingTotals] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def totals(self) -> RollingTotals:
+        """Running totals over `daily_stats`, built on first use."""
+        if self.rolling is None:
+            self.rolling = RollingTotals.from_stats(self.daily_stats.values())
+        return self.rolling
+
+    def track(self, stats: DailyStats):
+        """Bring the running totals up to date after `stats` changed."""
+        if self.rolling is not None:
+            self.rolling.update(stats)
 
     async def get_current_stats(self) -> DailyStats:
-        today = datetime.now().date().isoformat()
+        today = sys.intern(local_date(self.timezone).isoformat())
         if today not in self.daily_stats:
             self.daily_stats[today] = DailyStats(date=today)
 
-            temp = await get_temperature(self.city, WEATHER_API_KEY)
+            temp = await get_temperature(self.city, WEATHER_API_KEY, self.city_id)
             if temp is not None:
                 await self.update_daily_goals(temp)
             else:
                 stats = self.daily_stats[today]
-                stats.water_goal = self.calculate_water_goal(20)
+                stats.water_goal = self.calculate_water_goal(DEFAULT_TEMPERATURE)
                 stats.calorie_goal = self.calculate_calorie_goal()
-                stats.temperature = 20
+                stats.temperature = DEFAULT_TEMPERATURE
+            self.track(self.daily_stats[today])
 
         return self.daily_stats[today]
 
@@ -73,3 +196,4 @@ class UserProfile:
         stats.water_goal = self.calculate_water_goal(temperature)
         stats.calorie_goal = self.calculate_calorie_goal()
         stats.temperature = temperature
+        self.track(stats)
@@ -0,0 +1,115 @@
+"""Rate limiting of outgoing Bot API calls.
+
+`OutboundLimiter` is installed as a request middleware of the bot session.
+Calls addressed to a chat are paced to stay within Telegram's flood limits,
+both overall and per chat, and are retried after `TelegramRetryAfter`.
+Callers waiting for the overall limit are served by priority: replies to
+users first, background messages such as reminders after them. Background
+code marks its calls with `outbound_priority.set(BACKGROUND)`.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_CHAT_INTERVAL, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES
+from logger import logger
+from metrics import registry
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+outbound_priority = ContextVar("outbound_priority", default=INTERACTIVE)
+
+outbound_waiting = registry.gauge(
+    "bot_outbound_waiting", "Bot API calls waiting for the global rate limit", ["priority"]
+)
+outbound_retries = registry.counter(
+    "bot_outbound_retries_total", "Bot API calls retried after a flood-control error"
+)
+
+# Per-chat schedules are dropped once this many chats are tracked
+CHAT_TABLE_SIZE = 10000
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Paces calls with a chat_id using GCRA (a virtual-time token bucket).
+
+    Globally at most `rate` calls per second with bursts of `burst`, and per
+    chat one call every `chat_interval` seconds with bursts of `chat_burst`.
+    """
+
+    def __init__(self, rate=OUTBOUND_RATE, burst=OUTBOUND_BURST, chat_interval=OUTBOUND_CHAT_INTERVAL,
+                 chat_burst=OUTBOUND_CHAT_BURST, max_retries=OUTBOUND_MAX_RETRIES):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.chat_interval = chat_interval
+        self.chat_tolerance = (chat_burst - 1) * chat_interval
+        self.max_retries = max_retries
+        self._tat = 0.0
+        self._chat_tat = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._pump = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        for attempt in itertools.count():
+            await self._wait_chat(chat_id)
+            await self._wait_global(outbound_priority.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                outbound_retries.inc()
+                logger.warning("Flood control for chat {}, retrying in {}s", chat_id, e.retry_after)
+                self._chat_tat[chat_id] = time.monotonic() + e.retry_after + self.chat_tolerance
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        if len(self._chat_tat) > CHAT_TABLE_SIZE:
+            self._chat_tat = {chat: tat for chat, tat in self._chat_tat.items() if tat > now}
+        tat = max(self._chat_tat.get(chat_id, now), now)
+        self._chat_tat[chat_id] = tat + self.chat_interval
+        delay = tat - self.chat_tolerance - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _global_delay(self):
+        return max(self._tat, time.monotonic()) - self.tolerance - time.monotonic()
+
+    def _take_global(self):
+        self._tat = max(self._tat, time.monotonic()) + self.interval
+
+    async def _wait_global(self, priority):
+        if not self._waiters and self._global_delay() <= 0:
+            self._take_global()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        outbound_waiting.inc(priority)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self):
+        while self._waiters:
+            delay = self._global_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            priority, _, future = heapq.heappop(self._waiters)
+            outbound_waiting.dec(priority)
+            if future.done():
+                continue
+            self._take_global()
+            future.set_result(None)
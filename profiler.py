@@ -0,0 +1,193 @@
+"""On-demand sampling profiler for the running bot.
+
+Started for a limited time by an admin with `/profile [seconds]` or by
+sending SIGUSR1 to the process. While it runs, a thread samples the stack of
+the event loop thread every `interval` seconds. Each stack is rooted at the
+coroutine of the asyncio task that was running, so time spent in the
+same handler groups together whatever awaited it.
+
+The loop also updates a heartbeat every `interval`. When the heartbeat is
+late by more than `lag_threshold`, a callback is blocking the loop, and
+the sampled stack at that moment is recorded as the culprit.
+
+Samples are written in the collapsed-stack format read by flamegraph.pl and
+speedscope. Nothing runs while the profiler is off.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+from config import PROFILE_INTERVAL, PROFILE_LAG_THRESHOLD, PROFILE_SECONDS, PROFILE_DIR
+from logger import logger
+
+# The loop waits for I/O in these frames when it has nothing to run
+IDLE_FUNCTIONS = frozenset(("select", "poll", "epoll", "kqueue", "control"))
+
+
+@dataclass
+class Stall:
+    """The loop did not run its heartbeat for `duration` seconds."""
+    started: float
+    duration: float
+    stack: str
+
+
+@dataclass
+class Profile:
+    duration: float
+    interval: float
+    samples: Counter = field(default_factory=Counter)
+    stalls: List[Stall] = field(default_factory=list)
+
+    def collapsed(self):
+        """Samples as "frame;frame;... count" lines, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def stalls_report(self):
+        lines = []
+        for stall in sorted(self.stalls, key=lambda stall: -stall.duration):
+            lines.append(f"{stall.duration * 1000:.0f} ms blocked at +{stall.started:.3f}s")
+            lines.extend(f"    {frame}" for frame in stall.stack.split(";"))
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=5):
+        total = sum(self.samples.values())
+        busy = Counter()
+        for stack, count in self.samples.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if leaf != "[idle]":
+                busy[leaf] += count
+        lines = [f"{total} samples over {self.duration:.0f}s, loop busy {sum(busy.values()) * 100 / max(total, 1):.0f}%"]
+        lines += [f"{count * 100 / total:5.1f}% {frame}" for frame, count in busy.most_common(top)]
+        if self.stalls:
+            worst = max(self.stalls, key=lambda stall: stall.duration)
+            lines.append(f"{len(self.stalls)} loop stalls, worst {worst.duration * 1000:.0f} ms in "
+                         f"{worst.stack.rsplit(';', 1)[-1]}")
+        return "\n".join(lines)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, task=None):
+    """Collapsed stack of `frame`, rooted at the coroutine of `task`."""
+    if frame.f_code.co_name in IDLE_FUNCTIONS:
+        return "[idle]"
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame).replace(";", ":"))
+        frame = frame.f_back
+    if task is not None:
+        coro = task.get_coro()
+        names.append(f"[task {getattr(coro, '__qualname__', type(coro).__name__)}]")
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL, lag_threshold=PROFILE_LAG_THRESHOLD):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self._running = False
+        self._task = None
+
+    @property
+    def running(self):
+        return self._running
+
+    async def run(self, duration):
+        """Profile the current event loop for `duration` seconds."""
+        if self._running:
+            raise RuntimeError("A profile is already running")
+        self._running = True
+        loop = asyncio.get_running_loop()
+        profile = Profile(duration, self.interval)
+        heartbeat = [time.monotonic(), None]
+
+        def beat():
+            heartbeat[0] = time.monotonic()
+            heartbeat[1] = loop.call_later(self.interval, beat)
+
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(loop, threading.get_ident(), profile, heartbeat, stop),
+            name="profiler", daemon=True,
+        )
+        beat()
+        sampler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            stop.set()
+            heartbeat[1].cancel()
+            await asyncio.to_thread(sampler.join)
+            self._running = False
+        return profile
+
+    def _sample(self, loop, thread_id, profile, heartbeat, stop):
+        # Only read here: the loop thread owns both structures
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+        started = time.monotonic()
+        stall = stall_beat = None
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = collapse_stack(frame, current_tasks.get(loop))
+            profile.samples[stack] += 1
+
+            last_beat = heartbeat[0]
+            lag = time.monotonic() - last_beat - self.interval
+            if lag < self.lag_threshold:
+                stall = stall_beat = None
+            elif last_beat != stall_beat:
+                stall, stall_beat = Stall(last_beat - started, lag, stack), last_beat
+                profile.stalls.append(stall)
+            else:
+                stall.duration = lag
+
+    async def run_to_file(self, duration=PROFILE_SECONDS, directory=PROFILE_DIR):
+        """Profile for `duration` seconds and write the collapsed stacks and
+        the stall report to `directory`."""
+        profile = await self.run(duration)
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = time.strftime("profile-%Y%m%d-%H%M%S")
+        (directory / f"{name}.collapsed").write_text(profile.collapsed(), encoding="utf-8")
+        if profile.stalls:
+            (directory / f"{name}.stalls.txt").write_text(profile.stalls_report(), encoding="utf-8")
+        logger.info("Profile written to {}:\n{}", directory / f"{name}.collapsed", profile.summary())
+        return profile
+
+    def trigger(self):
+        """Signal handler: start a file profile unless one is running."""
+        if self._running:
+            logger.warning("Profile already running, ignoring the signal")
+            return
+        logger.info("Profiling for {:g}s", PROFILE_SECONDS)
+        self._task = asyncio.ensure_future(self.run_to_file())
+        self._task.add_done_callback(_log_failure)
+
+    def install_signal_handler(self):
+        """Profile on SIGUSR1, where the platform supports it."""
+        try:
+            import signal
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.trigger)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            logger.debug("SIGUSR1 profiling is not available on this platform")
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Profiling failed: {}", task.exception())
+
+
+profiler = SamplingProfiler()
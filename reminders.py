@@ -0,0 +1,197 @@
+"""Hydration reminders for users who fall behind their water goal.
+
+Users are kept in one heap ordered by the time of their next check, served
+by a single task, instead of a timer per user. A check looks at the user's
+local time: during waking hours the water goal is expected to be drunk at
+an even pace, and a user who is more than a glass behind that pace today is
+sent a reminder. Either way the next check is scheduled `interval` seconds
+later, or at the start of the next waking period.
+
+Reminders go out with background priority, so the outbound limiter sends
+replies to users first when the bot is near Telegram's flood limits.
+"""
+import asyncio
+import heapq
+import random
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+from config import (
+    REMINDER_INTERVAL, REMINDER_START_HOUR, REMINDER_END_HOUR, REMINDER_CONCURRENCY
+)
+from logger import logger
+from metrics import registry
+from models import get_zone
+from outbound import outbound_priority, BACKGROUND
+from storage import storage as default_storage
+
+WATER_GLASS = 250
+
+reminders_sent = registry.counter(
+    "bot_reminders_sent_total", "Hydration reminders sent"
+)
+reminders_scheduled = registry.gauge(
+    "bot_reminders_scheduled", "Users with a scheduled hydration check"
+)
+
+
+def water_behind(stats, now, start_hour=REMINDER_START_HOUR, end_hour=REMINDER_END_HOUR):
+    """Millilitres `stats` is behind an even pace over the waking hours at
+    the local time `now`."""
+    start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    elapsed = (now - start) / timedelta(hours=end_hour - start_hour)
+    expected = stats.water_goal * min(max(elapsed, 0), 1)
+    return expected - stats.logged_water
+
+
+class ReminderScheduler:
+    """Checks every scheduled user once per `interval` during waking hours.
+
+    `_due` holds the current check time of each user; heap entries that no
+    longer match it were rescheduled and are skipped when popped.
+    """
+
+    def __init__(self, storage=default_storage, interval=REMINDER_INTERVAL, start_hour=REMINDER_START_HOUR,
+                 end_hour=REMINDER_END_HOUR, concurrency=REMINDER_CONCURRENCY):
+        self.storage = storage
+        self.interval = interval
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.concurrency = concurrency
+        self.bot = None
+        self._heap = []
+        self._due = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self, bot):
+        if self._task is not None:
+            return
+        self.bot = bot
+        # Spread the first checks over one interval instead of all at once
+        now = time.time()
+        for user_id in await self.storage.reminder_user_ids():
+            if user_id not in self._due:
+                self.schedule(user_id, now + random.uniform(0, self.interval))
+        self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def schedule(self, user_id, due=None):
+        """Check `user_id` at the unix time `due`, by default one interval from now."""
+        due = time.time() + self.interval if due is None else due
+        if self._heap and due < self._heap[0][0]:
+            self._wakeup.set()
+        self._due[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+        reminders_scheduled.set(len(self._due))
+
+    def cancel(self, user_id):
+        self._due.pop(user_id, None)
+        reminders_scheduled.set(len(self._due))
+
+    def _pop_due(self, now):
+        user_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) == due:
+                del self._due[user_id]
+                user_ids.append(user_id)
+        # Drop superseded entries once they outnumber the live ones
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, user_id) for user_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+        reminders_scheduled.set(len(self._due))
+        return user_ids
+
+    async def _loop(self):
+        outbound_priority.set(BACKGROUND)
+        while True:
+            user_ids = self._pop_due(time.time())
+            if user_ids:
+                await self._check_batch(user_ids)
+
+            delay = self._heap[0][0] - time.time() if self._heap else self.interval
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check_batch(self, user_ids):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(user_id):
+            async with semaphore:
+                try:
+                    due = await self.check(user_id)
+                except Exception as e:
+                    logger.error("Hydration check failed for user {}: {}", user_id, e)
+                    due = time.time() + self.interval
+            if due is not None and user_id not in self._due:
+                self.schedule(user_id, due)
+
+        await asyncio.gather(*(check(user_id) for user_id in user_ids))
+
+    async def check(self, user_id):
+        """Remind `user_id` if needed and return when to check next, or None
+        to stop checking.
+
+        Reads only the settings and today's stats, so checking idle users
+        neither loads their history nor pushes active profiles out of memory.
+        """
+        settings = await self.storage.reminder_settings(user_id)
+        if settings is None:
+            return None
+        enabled, timezone = settings
+        if not enabled:
+            return None
+
+        now = datetime.now(get_zone(timezone))
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=self.start_hour)
+        end = start + timedelta(hours=self.end_hour - self.start_hour)
+        if now < start:
+            return start.timestamp()
+        if now >= end:
+            return (start + timedelta(days=1)).timestamp()
+
+        # Only users who started the day, by hand or through the rollover
+        stats = await self.storage.day_stats(user_id, now.date().isoformat())
+        if stats is not None and stats.water_goal > 0:
+            behind = water_behind(stats, now, self.start_hour, self.end_hour)
+            if behind >= WATER_GLASS:
+                await self._remind(user_id, stats, behind)
+        return time.time() + self.interval
+
+    async def _remind(self, user_id, stats, behind):
+        try:
+            await self.bot.send_message(
+                user_id,
+                f"Time for some water! You've had {stats.logged_water:.0f} of {stats.water_goal:.0f} ml today, "
+                f"about {behind:.0f} ml behind.\n"
+                "Log it with /log_water <ml>, or turn reminders off with /reminders off",
+            )
+        except TelegramForbiddenError:
+            logger.info("User {} blocked the bot, disabling reminders", user_id)
+            profile = await self.storage.get_profile(user_id)
+            if profile is not None:
+                profile.reminders = False
+                await self.storage.update_profile(profile)
+            return
+        except TelegramAPIError as e:
+            logger.error("Failed to send a reminder to user {}: {}", user_id, e)
+            return
+        reminders_sent.inc()
+
+
+reminders = ReminderScheduler()
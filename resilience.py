@@ -0,0 +1,221 @@
+"""Guards for calls to external APIs: rate limits, concurrency caps, a
+circuit breaker and per-handler deadline budgets.
+
+A handler runs inside `deadline(seconds)`, and every upstream request made
+on its behalf gets only the time that is left. `UpstreamGuard.slot()` raises
+`UpstreamUnavailable` instead of waiting when the upstream is known to be
+unhealthy or the budget would run out, so callers can fall back right away.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+
+from metrics import registry
+
+circuit_open = registry.gauge(
+    "bot_upstream_circuit_open", "1 while the circuit breaker of an upstream is open", ["upstream"]
+)
+
+_deadline = ContextVar("deadline", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, upstream, reason):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+@contextmanager
+def deadline(seconds):
+    """Limit the time code in the block may spend on upstream requests.
+
+    Nested deadlines can only shorten the outer one.
+    """
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        expires_at = min(expires_at, outer)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def clear_deadline():
+    """Drop the deadline inherited by a background task from its handler."""
+    _deadline.set(None)
+
+
+def remaining():
+    """Seconds left in the current deadline, or None outside of one."""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `burst`.
+
+    Callers reserve a token and sleep until it is due, so waiting callers
+    are served in arrival order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, timeout=None):
+        """Take a token, waiting at most `timeout` seconds. Returns False
+        without taking one if it would not be available in time."""
+        self._refill()
+        delay = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if timeout is not None and delay > timeout:
+            return False
+        self.tokens -= 1
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.tokens += 1
+                raise
+        return True
+
+    def release(self):
+        """Give back a token taken by `acquire` that was not used."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open, calls are rejected except for one probe per `reset_timeout`
+    seconds; a successful probe closes the breaker again. A probe that is
+    never sent must be handed back with `release()`.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """Let another call probe, the current probe was not sent."""
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class UpstreamGuard:
+    """Rate limit, concurrency cap and circuit breaker of one upstream."""
+
+    def __init__(self, name, rate, burst, concurrency, failure_threshold, reset_timeout, timeout,
+                 min_timeout=0):
+        self.name = name
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _unavailable(self, reason):
+        return UpstreamUnavailable(self.name, reason)
+
+    def _budget(self):
+        budget = remaining()
+        if budget is not None and budget <= 0:
+            raise self._unavailable("deadline")
+        return budget
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for permission to send one request and yield its timeout.
+
+        A request left with less than `min_timeout` seconds of the budget
+        after waiting is not sent. Connection errors inside the block, and
+        timeouts of requests given the full `timeout`, count as failures;
+        the caller reports responses with `record(status)`.
+        """
+        if not self.breaker.allow():
+            raise self._unavailable("circuit_open")
+        probe = self.breaker.is_open
+        try:
+            if not await self.bucket.acquire(self._budget()):
+                raise self._unavailable("rate_limited")
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self._budget())
+            except asyncio.TimeoutError:
+                self.bucket.release()
+                raise self._unavailable("busy") from None
+            budget = remaining()
+            if budget is not None and (budget <= 0 or budget < self.min_timeout):
+                self._semaphore.release()
+                self.bucket.release()
+                raise self._unavailable("deadline")
+        except BaseException:
+            if probe:
+                self.breaker.release()
+            raise
+
+        # Cut short by the deadline, a timeout says nothing about the upstream
+        shortened = budget is not None and budget < self.timeout
+        try:
+            yield aiohttp.ClientTimeout(total=self.timeout if budget is None else min(self.timeout, budget))
+        except asyncio.TimeoutError:
+            if not shortened:
+                self._record(False)
+            raise
+        except aiohttp.ClientError:
+            self._record(False)
+            raise
+        finally:
+            self._semaphore.release()
+            # A probe that ended without a recorded outcome
+            if probe and self.breaker.probing:
+                self.breaker.release()
+
+    def record(self, status):
+        """Report an HTTP response; 5xx and 429 count as failures."""
+        self._record(status < 500 and status != 429)
+
+    def _record(self, ok):
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        circuit_open.set(int(self.breaker.is_open), self.name)
@@ -0,0 +1,169 @@
+"""Background rollover of users' days ahead of their local midnight.
+
+Without it the first message after midnight creates the day lazily in
+`UserProfile.get_current_stats`, so every active user fetches the weather
+within the same few minutes and waits for it. The scheduler instead creates
+the coming day for recently active users shortly before it starts in their
+timezone, fetching the temperature once per city and computing the goals
+for a whole batch at once.
+"""
+import asyncio
+import sys
+import time
+from datetime import timedelta
+
+from config import (
+    WEATHER_API_KEY, ROLLOVER_INTERVAL, ROLLOVER_LEAD, ROLLOVER_CONCURRENCY, ROLLOVER_BATCH
+)
+from external_api import get_temperature, weather_location
+from logger import logger
+from metrics import registry
+from models import (
+    DailyStats, WATER_PER_KG, WATER_PER_ACTIVITY, WATER_HOT_WEATHER, DEFAULT_TEMPERATURE, local_date
+)
+from storage import storage as default_storage
+
+rolled_users = registry.counter(
+    "bot_rollover_users_total", "Days created ahead of time by the rollover scheduler"
+)
+rollover_latency = registry.histogram(
+    "bot_rollover_seconds", "Duration of rollover runs", buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+
+
+def daily_goals(profiles, temperatures):
+    """Water and calorie goals for `profiles` at the matching temperatures.
+
+    Vectorized equivalent of `UserProfile.calculate_water_goal` and
+    `UserProfile.calculate_calorie_goal`.
+    """
+    import numpy as np
+
+    count = len(profiles)
+    weight = np.fromiter((p.weight for p in profiles), np.float64, count)
+    height = np.fromiter((p.height for p in profiles), np.float64, count)
+    age = np.fromiter((p.age for p in profiles), np.int64, count)
+    activity = np.fromiter((p.activity_minutes for p in profiles), np.int64, count)
+    temperature = np.asarray(temperatures, dtype=np.float64)
+
+    water = (
+        weight * WATER_PER_KG
+        + (activity // 30) * WATER_PER_ACTIVITY
+        + np.where(temperature > 25, WATER_HOT_WEATHER, 0)
+    )
+    calories = 10 * weight + 6.25 * height - 5 * age + activity * 4
+    return water.tolist(), calories.tolist()
+
+
+class RolloverScheduler:
+    """Periodically creates the coming day's `DailyStats` for active users.
+
+    Every `interval` seconds each timezone in use is checked: the target day
+    is the local date `lead` seconds from now, and users who logged anything
+    on the day before it but have no stats for it yet are rolled over in
+    batches of `batch_size`, with at most `concurrency` weather requests in
+    flight. Progress lives in the storage itself, so an interrupted run is
+    simply continued by the next one.
+    """
+
+    def __init__(self, storage=default_storage, interval=ROLLOVER_INTERVAL, lead=ROLLOVER_LEAD,
+                 concurrency=ROLLOVER_CONCURRENCY, batch_size=ROLLOVER_BATCH):
+        self.storage = storage
+        self.interval = interval
+        self.lead = lead
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Rollover failed: {}", e)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now=None):
+        """Roll over every due user and return how many days were created."""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        rolled = 0
+        for timezone in await self.storage.timezones():
+            try:
+                day = local_date(timezone, now + self.lead)
+            except (KeyError, ValueError) as e:
+                logger.error("Skipping rollover for unknown timezone {!r}: {}", timezone, e)
+                continue
+            user_ids = await self.storage.rollover_candidates(
+                timezone, (day - timedelta(days=1)).isoformat(), day.isoformat()
+            )
+            for i in range(0, len(user_ids), self.batch_size):
+                rolled += await self._roll_batch(user_ids[i:i + self.batch_size], sys.intern(day.isoformat()))
+
+        rollover_latency.observe(time.perf_counter() - started)
+        if rolled:
+            logger.info("Rolled over {} users in {:.2f}s", rolled, time.perf_counter() - started)
+        return rolled
+
+    async def _roll_batch(self, user_ids, day):
+        profiles = []
+        for user_id in user_ids:
+            profile = await self.storage.get_profile(user_id)
+            if profile is not None and day not in profile.daily_stats:
+                profiles.append(profile)
+        if not profiles:
+            return 0
+
+        cities = {}
+        keys = []
+        for profile in profiles:
+            key, _ = weather_location(profile.city, profile.city_id)
+            cities.setdefault(key, profile)
+            keys.append(key)
+        temperatures = await self._fetch_temperatures(cities)
+        batch_temperatures = [temperatures[key] for key in keys]
+        water_goals, calorie_goals = daily_goals(profiles, batch_temperatures)
+
+        rolled = 0
+        for profile, temperature, water_goal, calorie_goal in zip(
+            profiles, batch_temperatures, water_goals, calorie_goals
+        ):
+            # The user may have started the day while the weather was fetched
+            if day in profile.daily_stats:
+                continue
+            stats = profile.daily_stats[day] = DailyStats(
+                date=day, water_goal=water_goal, calorie_goal=calorie_goal, temperature=temperature
+            )
+            await self.storage.update_counters(profile.user_id, stats)
+            rolled += 1
+        rolled_users.inc(amount=rolled)
+        return rolled
+
+    async def _fetch_temperatures(self, cities):
+        """Temperature per weather location key, one request per location."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(profile):
+            async with semaphore:
+                temperature = await get_temperature(profile.city, WEATHER_API_KEY, profile.city_id)
+            return DEFAULT_TEMPERATURE if temperature is None else temperature
+
+        values = await asyncio.gather(*(fetch(profile) for profile in cities.values()))
+        return dict(zip(cities, values))
+
+
+rollover = RolloverScheduler()
@@ -1,6 +1,5 @@
 from aiogram.fsm.state import State, StatesGroup
 
-users = {}
 
 class ProfileSetup(StatesGroup):
     weight = State()
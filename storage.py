@@ -0,0 +1,536 @@
+import asyncio
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import aiosqlite
+
+from config import STORAGE_BACKEND, STORAGE_PATH, STORAGE_FLUSH_INTERVAL, STORAGE_FLUSH_BATCH, STORAGE_CACHE_SIZE
+from logger import logger
+from metrics import registry
+
+from models import DailyStats, UserProfile, FoodEntry, WorkoutEntry
+
+
+resident_profiles = registry.gauge(
+    "bot_storage_resident_profiles", "Profiles held in memory by the storage"
+)
+profile_evictions = registry.counter(
+    "bot_storage_evictions_total", "Idle profiles dropped from memory"
+)
+profile_fault_latency = registry.histogram(
+    "bot_storage_fault_seconds", "Time to load a profile that is not in memory",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+
+def _is_active(stats):
+    return stats is not None and bool(stats.logged_water or stats.logged_calories or stats.burned_calories)
+
+
+class MemoryStorage:
+    """Repository of user profiles and their daily stats kept in a dict.
+
+    Handlers mutate `DailyStats` in place and then report the change through
+    `update_profile`, `update_counters`, `append_food` or `append_workout`
+    so that durable backends know what to persist.
+    """
+
+    def __init__(self):
+        self._profiles = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_profile(self, user_id):
+        return self._profiles.get(user_id)
+
+    async def has_profile(self, user_id):
+        return await self.get_profile(user_id) is not None
+
+    async def put_profile(self, profile):
+        self._profiles[profile.user_id] = profile
+
+    async def update_profile(self, profile):
+        """Report a change of the profile's own fields, not of its stats."""
+        self._profiles[profile.user_id] = profile
+
+    async def update_counters(self, user_id, stats):
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            profile.track(stats)
+
+    async def user_ids(self):
+        return list(self._profiles)
+
+    async def reminder_user_ids(self):
+        return [profile.user_id for profile in self._profiles.values() if profile.reminders]
+
+    async def reminder_settings(self, user_id):
+        """`(reminders, timezone)` of `user_id`, or None for unknown users."""
+        profile = self._profiles.get(user_id)
+        return None if profile is None else (profile.reminders, profile.timezone)
+
+    async def day_stats(self, user_id, day):
+        """Stats of `user_id` for the ISO date `day`, or None."""
+        profile = self._profiles.get(user_id)
+        return None if profile is None else profile.daily_stats.get(day)
+
+    async def timezones(self):
+        return {profile.timezone for profile in self._profiles.values()}
+
+    async def rollover_candidates(self, timezone, previous_day, day):
+        """Ids of users in `timezone` who logged anything on `previous_day`
+        and have no stats for `day` yet."""
+        return [
+            profile.user_id for profile in self._profiles.values()
+            if profile.timezone == timezone and day not in profile.daily_stats
+            and _is_active(profile.daily_stats.get(previous_day))
+        ]
+
+    async def append_food(self, user_id, stats, entry):
+        stats.food_log.append(entry)
+        await self.update_counters(user_id, stats)
+
+    async def append_foods(self, user_id, stats, entries):
+        for entry in entries:
+            stats.food_log.append(entry)
+        await self.update_counters(user_id, stats)
+
+    async def append_workout(self, user_id, stats, entry):
+        stats.workout_log.append(entry)
+        await self.update_counters(user_id, stats)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    weight REAL NOT NULL,
+    height REAL NOT NULL,
+    age INTEGER NOT NULL,
+    activity_minutes INTEGER NOT NULL,
+    city TEXT NOT NULL,
+    city_id INTEGER NOT NULL DEFAULT 0,
+    timezone TEXT NOT NULL DEFAULT '',
+    reminders INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    logged_water REAL NOT NULL,
+    logged_calories REAL NOT NULL,
+    burned_calories REAL NOT NULL,
+    water_goal REAL NOT NULL,
+    calorie_goal REAL NOT NULL,
+    temperature REAL NOT NULL,
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_stats_date ON daily_stats (date);
+CREATE TABLE IF NOT EXISTS food_log (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    weight REAL NOT NULL,
+    calories REAL NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS food_log_user_date ON food_log (user_id, date);
+CREATE TABLE IF NOT EXISTS workout_log (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    calories REAL NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS workout_log_user_date ON workout_log (user_id, date);
+"""
+
+UPSERT_USER = """
+INSERT INTO users (user_id, weight, height, age, activity_minutes, city, city_id, timezone, reminders)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    weight = excluded.weight,
+    height = excluded.height,
+    age = excluded.age,
+    activity_minutes = excluded.activity_minutes,
+    city = excluded.city,
+    city_id = excluded.city_id,
+    timezone = excluded.timezone,
+    reminders = excluded.reminders
+"""
+
+SELECT_ROLLOVER_CANDIDATES = """
+SELECT previous.user_id FROM daily_stats AS previous
+JOIN users USING (user_id)
+WHERE users.timezone = ? AND previous.date = ?
+    AND (previous.logged_water > 0 OR previous.logged_calories > 0 OR previous.burned_calories > 0)
+    AND NOT EXISTS (
+        SELECT 1 FROM daily_stats AS current
+        WHERE current.user_id = previous.user_id AND current.date = ?
+    )
+"""
+
+UPSERT_DAILY_STATS = """
+INSERT INTO daily_stats (
+    user_id, date, logged_water, logged_calories, burned_calories,
+    water_goal, calorie_goal, temperature
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, date) DO UPDATE SET
+    logged_water = excluded.logged_water,
+    logged_calories = excluded.logged_calories,
+    burned_calories = excluded.burned_calories,
+    water_goal = excluded.water_goal,
+    calorie_goal = excluded.calorie_goal,
+    temperature = excluded.temperature
+"""
+
+
+class SQLiteStorage(MemoryStorage):
+    """SQLite (WAL) backed repository with batched, coalesced writes.
+
+    Profiles are loaded on first access rather than at startup. Changes are
+    buffered and written in a single transaction every `flush_interval`
+    seconds, or sooner once `flush_batch` changes are pending, so repeated
+    updates of the same day collapse into one row write.
+
+    At most `cache_size` profiles stay in memory, in least recently used
+    order. Beyond that idle profiles are dropped once their changes are
+    written, and loaded again from the database on their next access, so
+    memory follows the number of active users rather than all users.
+    """
+
+    def __init__(self, path=STORAGE_PATH, flush_interval=STORAGE_FLUSH_INTERVAL,
+                 flush_batch=STORAGE_FLUSH_BATCH, cache_size=STORAGE_CACHE_SIZE):
+        super().__init__()
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cache_size = cache_size
+        self._profiles = OrderedDict()
+        self._dirty_users = set()
+        # Users whose changes are being written; clean only once committed
+        self._flushing_users = set()
+        self._flushing_stats = {}
+        self._db = None
+        self._flusher = None
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._dirty_profiles = {}
+        self._dirty_stats = {}
+        self._pending_food = []
+        self._pending_workout = []
+
+    async def start(self):
+        if self._db is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.executescript(SCHEMA)
+        await self._migrate()
+        await self._db.commit()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._db is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.flush()
+        finally:
+            await self._db.close()
+            self._db = None
+
+    async def _migrate(self):
+        async with self._db.execute("PRAGMA table_info(users)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if "timezone" not in columns:
+            await self._db.execute("ALTER TABLE users ADD COLUMN timezone TEXT NOT NULL DEFAULT ''")
+        if "city_id" not in columns:
+            await self._db.execute("ALTER TABLE users ADD COLUMN city_id INTEGER NOT NULL DEFAULT 0")
+        if "reminders" not in columns:
+            await self._db.execute("ALTER TABLE users ADD COLUMN reminders INTEGER NOT NULL DEFAULT 1")
+
+    async def get_profile(self, user_id):
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            self._profiles.move_to_end(user_id)
+            return profile
+
+        started = time.perf_counter()
+        profile = await self._load_profile(user_id)
+        profile_fault_latency.observe(time.perf_counter() - started)
+        if profile is None:
+            return None
+        # A task may still hold the evicted profile and report changes of it,
+        # which are newer than the rows just read
+        for stats in self._pending_stats(user_id):
+            profile.daily_stats[stats.date] = stats
+        # Another task may have loaded or created the profile meanwhile
+        profile = self._profiles.setdefault(user_id, profile)
+        self._profiles.move_to_end(user_id)
+        self._evict()
+        return profile
+
+    async def put_profile(self, profile):
+        await super().put_profile(profile)
+        self._profiles.move_to_end(profile.user_id)
+        self._dirty_users.add(profile.user_id)
+        self._dirty_profiles[profile.user_id] = profile
+        for stats in profile.daily_stats.values():
+            self._dirty_stats[(profile.user_id, stats.date)] = stats
+        self._request_flush()
+        self._evict()
+
+    async def update_profile(self, profile):
+        await super().update_profile(profile)
+        self._profiles.move_to_end(profile.user_id)
+        self._dirty_users.add(profile.user_id)
+        self._dirty_profiles[profile.user_id] = profile
+        self._request_flush()
+
+    async def update_counters(self, user_id, stats):
+        await super().update_counters(user_id, stats)
+        self._dirty_users.add(user_id)
+        self._dirty_stats[(user_id, stats.date)] = stats
+        self._request_flush()
+
+    def _pending_stats(self, user_id):
+        for batch in (self._flushing_stats, self._dirty_stats):
+            for (owner, _), stats in batch.items():
+                if owner == user_id:
+                    yield stats
+
+    def _evict(self):
+        """Drop the least recently used profiles beyond `cache_size`.
+
+        Profiles with changes that are not committed yet stay until the
+        flush writing them succeeds.
+        """
+        excess = len(self._profiles) - self.cache_size
+        if self.cache_size <= 0 or excess <= 0:
+            resident_profiles.set(len(self._profiles))
+            return
+        idle = []
+        for user_id in self._profiles:
+            if len(idle) == excess:
+                break
+            if user_id not in self._dirty_users and user_id not in self._flushing_users:
+                idle.append(user_id)
+        for user_id in idle:
+            del self._profiles[user_id]
+        profile_evictions.inc(amount=len(idle))
+        resident_profiles.set(len(self._profiles))
+
+    async def user_ids(self):
+        await self.flush()
+        async with self._db.execute("SELECT user_id FROM users ORDER BY user_id") as cursor:
+            return [user_id for user_id, in await cursor.fetchall()]
+
+    async def reminder_user_ids(self):
+        await self.flush()
+        async with self._db.execute("SELECT user_id FROM users WHERE reminders ORDER BY user_id") as cursor:
+            return [user_id for user_id, in await cursor.fetchall()]
+
+    # Read without loading the whole profile: a profile in memory holds the
+    # latest values, and one that is not has no unwritten changes.
+    async def reminder_settings(self, user_id):
+        if user_id in self._profiles:
+            return await super().reminder_settings(user_id)
+        async with self._db.execute("SELECT reminders, timezone FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else (bool(row[0]), row[1])
+
+    async def day_stats(self, user_id, day):
+        if user_id in self._profiles:
+            return await super().day_stats(user_id, day)
+        async with self._db.execute(
+            "SELECT date, logged_water, logged_calories, burned_calories, "
+            "water_goal, calorie_goal, temperature FROM daily_stats WHERE user_id = ? AND date = ?",
+            (user_id, day),
+        ) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else DailyStats(*row)
+
+    async def append_food(self, user_id, stats, entry):
+        self._pending_food.append((user_id, stats.date, *entry))
+        await super().append_food(user_id, stats, entry)
+
+    async def append_foods(self, user_id, stats, entries):
+        self._pending_food.extend((user_id, stats.date, *entry) for entry in entries)
+        await super().append_foods(user_id, stats, entries)
+
+    async def append_workout(self, user_id, stats, entry):
+        self._pending_workout.append((user_id, stats.date, *entry))
+        await super().append_workout(user_id, stats, entry)
+
+    async def timezones(self):
+        await self.flush()
+        async with self._db.execute("SELECT DISTINCT timezone FROM users") as cursor:
+            return {timezone for timezone, in await cursor.fetchall()}
+
+    async def rollover_candidates(self, timezone, previous_day, day):
+        await self.flush()
+        async with self._db.execute(SELECT_ROLLOVER_CANDIDATES, (timezone, previous_day, day)) as cursor:
+            return [user_id for user_id, in await cursor.fetchall()]
+
+    def _pending_count(self):
+        return (
+            len(self._dirty_profiles) + len(self._dirty_stats)
+            + len(self._pending_food) + len(self._pending_workout)
+        )
+
+    def _request_flush(self):
+        if self._pending_count() >= self.flush_batch:
+            self._flush_requested.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Storage flush failed: {}", e)
+
+    async def flush(self):
+        # One transaction at a time: statements of concurrent flushes would
+        # share it and be committed half-done
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending_count():
+            return
+
+        profiles, self._dirty_profiles = self._dirty_profiles, {}
+        stats, self._dirty_stats = self._dirty_stats, {}
+        food, self._pending_food = self._pending_food, []
+        workouts, self._pending_workout = self._pending_workout, []
+        users, self._dirty_users = self._dirty_users, set()
+        self._flushing_users = users
+        self._flushing_stats = stats
+
+        try:
+            await self._db.executemany(UPSERT_USER, [
+                (p.user_id, p.weight, p.height, p.age, p.activity_minutes, p.city, p.city_id, p.timezone,
+                 p.reminders)
+                for p in profiles.values()
+            ])
+            await self._db.executemany(UPSERT_DAILY_STATS, [
+                (user_id, s.date, s.logged_water, s.logged_calories, s.burned_calories,
+                 s.water_goal, s.calorie_goal, s.temperature)
+                for (user_id, _), s in stats.items()
+            ])
+            await self._db.executemany(
+                "INSERT INTO food_log (user_id, date, name, weight, calories, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                food,
+            )
+            await self._db.executemany(
+                "INSERT INTO workout_log (user_id, date, type, duration, calories, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                workouts,
+            )
+            await self._db.commit()
+        except BaseException:
+            await self._rollback(profiles, stats, food, workouts, users)
+            raise
+        finally:
+            self._flushing_users = set()
+            self._flushing_stats = {}
+        self._evict()
+
+    async def _rollback(self, profiles, stats, food, workouts, users):
+        """Undo a failed flush and queue its changes for the next one."""
+        try:
+            await self._db.rollback()
+        except Exception as e:
+            logger.error("Storage rollback failed: {}", e)
+        # Rows changed again since the flush started hold the newer values
+        for user_id, profile in profiles.items():
+            self._dirty_profiles.setdefault(user_id, profile)
+        for key, value in stats.items():
+            self._dirty_stats.setdefault(key, value)
+        self._pending_food[:0] = food
+        self._pending_workout[:0] = workouts
+        # Keep the profiles in memory, their changes are not on disk
+        self._dirty_users |= users
+
+    async def _load_profile(self, user_id):
+        async with self._db.execute(
+            "SELECT weight, height, age, activity_minutes, city, city_id, timezone, reminders "
+            "FROM users WHERE user_id = ?",
+            (user_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+
+        weight, height, age, activity_minutes, city, city_id, timezone, reminders = row
+        profile = UserProfile(
+            user_id=user_id,
+            weight=weight,
+            height=height,
+            age=age,
+            activity_minutes=activity_minutes,
+            city=city,
+            city_id=city_id,
+            timezone=timezone,
+            reminders=bool(reminders)
+        )
+
+        async with self._db.execute(
+            "SELECT date, logged_water, logged_calories, burned_calories, "
+            "water_goal, calorie_goal, temperature FROM daily_stats WHERE user_id = ?",
+            (user_id,),
+        ) as cursor:
+            async for date, *counters in cursor:
+                stats = DailyStats(date, *counters)
+                profile.daily_stats[stats.date] = stats
+
+        async with self._db.execute(
+            "SELECT date, name, weight, calories, timestamp FROM food_log "
+            "WHERE user_id = ? ORDER BY rowid",
+            (user_id,),
+        ) as cursor:
+            async for date, name, weight, calories, timestamp in cursor:
+                stats = profile.daily_stats.get(date)
+                if stats is not None:
+                    stats.food_log.append(FoodEntry(name, weight, calories, timestamp))
+
+        async with self._db.execute(
+            "SELECT date, type, duration, calories, timestamp FROM workout_log "
+            "WHERE user_id = ? ORDER BY rowid",
+            (user_id,),
+        ) as cursor:
+            async for date, workout_type, duration, calories, timestamp in cursor:
+                stats = profile.daily_stats.get(date)
+                if stats is not None:
+                    stats.workout_log.append(WorkoutEntry(workout_type, duration, calories, timestamp))
+
+        return profile
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+storage = create_storage()
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# config.py refuses to load without these
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("WEATHER_API_KEY", "test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,43 @@
+"""Offline food index lookups on a small dump."""
+import pytest
+
+from food_index import FoodIndex, build_index
+
+PRODUCTS = [
+    ("Salami", 400),
+    ("Oatmeal", 370),
+    ("Banana", 89),
+    ("Buckwheat groats", 343),
+    ("Apple", 52),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    dump = tmp_path / "products.csv"
+    lines = ["product_name\tenergy-kcal_100g"] + [f"{name}\t{calories}" for name, calories in PRODUCTS]
+    dump.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    build_index(dump, tmp_path / "food_index.sqlite")
+    index = FoodIndex(tmp_path / "food_index.sqlite")
+    yield index
+    index.close()
+
+
+def names(results):
+    return [product["name"] for product in results]
+
+
+def test_exact_and_partial_names(index):
+    assert names(index.search("banana", 1)) == ["Banana"]
+    assert names(index.search("buckwheat", 1)) == ["Buckwheat groats"]
+
+
+def test_typos_still_match(index):
+    assert names(index.search("bananna", 1)) == ["Banana"]
+    assert names(index.search("buckwhaet", 1)) == ["Buckwheat groats"]
+
+
+@pytest.mark.parametrize("query", ["salmon", "meatballs", "pineapple juice"])
+def test_near_misses_are_not_matches(index, query):
+    # Sharing a rare trigram or two is not enough, the API gets the query
+    assert index.search(query) == []
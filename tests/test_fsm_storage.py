@@ -0,0 +1,29 @@
+"""SQLite FSM storage and its read cache."""
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteFSMStorage
+
+TIMEOUT = 10
+
+
+def make_key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_cache_forgets_users_who_do_not_come_back(tmp_path):
+    async def scenario():
+        storage = SQLiteFSMStorage(tmp_path / "fsm.sqlite", cache_ttl=0.05)
+        try:
+            for user_id in range(100):
+                await storage.get_state(make_key(user_id))
+            assert len(storage._cache) == 100
+
+            await asyncio.sleep(0.1)
+            await storage.get_state(make_key(1000))
+            assert list(storage._cache) == [storage.key_builder.build(make_key(1000))]
+        finally:
+            await storage.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), TIMEOUT))
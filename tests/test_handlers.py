@@ -0,0 +1,113 @@
+"""Handlers against in-process storage, with the weather API stubbed out."""
+import asyncio
+from datetime import UTC, datetime
+from types import SimpleNamespace
+
+from aiogram.filters import CommandObject
+
+import handlers
+import models
+from aggregates import check_totals
+from history import parse_period
+from models import DailyStats, FoodEntry, UserProfile, local_date
+from storage import MemoryStorage, SQLiteStorage
+
+OLD_DAY = "2024-01-01"
+TIMEOUT = 10
+
+
+class FakeState:
+    def __init__(self, **data):
+        self.data = data
+
+    async def get_data(self):
+        return dict(self.data)
+
+    async def update_data(self, **data):
+        self.data.update(data)
+
+    async def clear(self):
+        self.data = {}
+
+
+class FakeMessage:
+    def __init__(self, text, user_id=1):
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+async def set_up(weight, city="Moscow"):
+    state = FakeState(weight=weight, height=180, age=30, activity=60)
+    message = FakeMessage(city)
+    await handlers.process_city(message, state)
+    assert message.answers[-1].startswith("Profile setup finished"), message.answers
+
+
+def test_setting_up_again_keeps_the_history(tmp_path, monkeypatch):
+    async def fake_temperature(city, api_key, city_id=0):
+        return 20.0
+
+    monkeypatch.setattr(handlers, "get_temperature", fake_temperature)
+    monkeypatch.setattr(models, "get_temperature", fake_temperature)
+    monkeypatch.setattr(handlers.reminders, "schedule", lambda user_id: None)
+
+    async def scenario():
+        storage = SQLiteStorage(tmp_path / "bot.sqlite", flush_interval=3600)
+        monkeypatch.setattr(handlers, "storage", storage)
+        await storage.start()
+        try:
+            await set_up(70)
+            profile = await storage.get_profile(1)
+            profile.daily_stats[OLD_DAY] = DailyStats(OLD_DAY, logged_water=1000, water_goal=2600)
+            await storage.update_counters(1, profile.daily_stats[OLD_DAY])
+            stats = await profile.get_current_stats()
+            stats.logged_calories += 89
+            await storage.append_food(1, stats, FoodEntry("Banana", 100, 89, 1714550400))
+
+            await set_up(80)
+            assert await storage.get_profile(1) is profile
+            assert profile.weight == 80
+            assert stats.water_goal == profile.calculate_water_goal(20.0)
+            assert check_totals(profile) == []
+            await storage.flush()
+        finally:
+            await storage.close()
+
+        storage = SQLiteStorage(tmp_path / "bot.sqlite", flush_interval=3600)
+        await storage.start()
+        try:
+            reloaded = await storage.get_profile(1)
+            assert reloaded.weight == 80
+            assert sorted(reloaded.daily_stats) == sorted(profile.daily_stats)
+            assert check_totals(reloaded) == []
+        finally:
+            await storage.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), TIMEOUT))
+
+
+def test_history_periods_end_on_the_users_local_day(monkeypatch):
+    # One of the two is always on a different day than UTC
+    timezone = "Pacific/Kiritimati" if datetime.now(UTC).hour >= 12 else "Etc/GMT+12"
+    profile = UserProfile(user_id=1, timezone=timezone)
+    storage = MemoryStorage()
+    monkeypatch.setattr(handlers, "storage", storage)
+    periods = []
+
+    def spy(text, today=None):
+        periods.append(parse_period(text, today))
+        return periods[-1]
+
+    monkeypatch.setattr(handlers, "parse_period", spy)
+
+    async def scenario():
+        await storage.put_profile(profile)
+        message = FakeMessage("/history week")
+        await handlers.cmd_history(message, CommandObject(prefix="/", command="history", args="week"), FakeState())
+
+    asyncio.run(asyncio.wait_for(scenario(), TIMEOUT))
+    assert periods[0][1] == local_date(timezone)
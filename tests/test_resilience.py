@@ -0,0 +1,203 @@
+"""Upstream guards against a local weather API stub that injects latency
+and errors."""
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import external_api
+from external_api import fetch_temperature, get_temperature
+from config import BREAKER_FAILURES
+from models import DEFAULT_TEMPERATURE, UserProfile
+from resilience import UpstreamGuard, UpstreamUnavailable, deadline
+from weather_cache import WeatherCache
+
+CITY = "Testville"
+RESET_TIMEOUT = 0.2
+
+
+class WeatherStub:
+    """OpenWeather stand-in answering with `status` after `delay` seconds."""
+
+    def __init__(self, monkeypatch, guard):
+        self.monkeypatch = monkeypatch
+        self.guard = guard
+        self.status = 200
+        self.delay = 0
+        self.temperature = 15.0
+        self.requests = 0
+        self._runner = None
+
+    async def _handle(self, request):
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.json_response({"message": "injected error"}, status=self.status)
+        return web.json_response({"main": {"temp": self.temperature}})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/weather", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.monkeypatch.setattr(external_api, "WEATHER_API_URL", f"http://127.0.0.1:{port}/weather")
+        self.monkeypatch.setattr(external_api, "weather_guard", self.guard)
+        self.monkeypatch.setattr(external_api, "weather_cache", WeatherCache(ttl=0))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await external_api.api_client.close()
+        await self._runner.cleanup()
+
+
+def make_guard(rate=100, burst=100, concurrency=10, failures=BREAKER_FAILURES, reset_timeout=RESET_TIMEOUT,
+               timeout=5, min_timeout=0):
+    return UpstreamGuard("weather", rate, burst, concurrency, failures, reset_timeout, timeout, min_timeout)
+
+
+async def assert_unavailable(guard, reason):
+    with pytest.raises(UpstreamUnavailable) as raised:
+        async with guard.slot():
+            pass
+    assert raised.value.reason == reason
+
+
+def test_breaker_opens_after_failures_and_half_opens(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard()) as stub:
+            stub.status = 500
+            for _ in range(BREAKER_FAILURES):
+                assert await fetch_temperature(CITY, "key") is None
+            assert stub.guard.breaker.is_open
+            assert stub.requests == BREAKER_FAILURES
+
+            # Open: rejected without reaching the upstream
+            assert await fetch_temperature(CITY, "key") is None
+            assert stub.requests == BREAKER_FAILURES
+            await assert_unavailable(stub.guard, "circuit_open")
+
+            # Half-open after the reset timeout: one probe, which closes it
+            await asyncio.sleep(RESET_TIMEOUT)
+            stub.status = 200
+            assert await fetch_temperature(CITY, "key") == stub.temperature
+            assert stub.requests == BREAKER_FAILURES + 1
+            assert not stub.guard.breaker.is_open
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens_breaker(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard(failures=1)) as stub:
+            stub.status = 503
+            assert await fetch_temperature(CITY, "key") is None
+            await asyncio.sleep(RESET_TIMEOUT)
+
+            assert await fetch_temperature(CITY, "key") is None
+            assert stub.requests == 2
+            assert stub.guard.breaker.is_open
+            await assert_unavailable(stub.guard, "circuit_open")
+
+    asyncio.run(scenario())
+
+
+def test_stale_temperature_is_used_while_upstream_fails(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard()) as stub:
+            assert await get_temperature(CITY, "key") == 15.0
+            stub.status = 500
+            stub.temperature = 30.0
+            assert await get_temperature(CITY, "key") == 15.0
+            assert stub.requests == 2
+
+    asyncio.run(scenario())
+
+
+def test_default_temperature_without_any_reading(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard()) as stub:
+            stub.status = 500
+            profile = UserProfile(user_id=1, weight=70, height=180, age=30, activity_minutes=60, city=CITY)
+            stats = await profile.get_current_stats()
+            assert stats.temperature == DEFAULT_TEMPERATURE
+            assert stats.water_goal == profile.calculate_water_goal(DEFAULT_TEMPERATURE)
+            assert stub.requests == 1
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_surfaces_as_unavailable(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard(rate=0.01, burst=1)) as stub:
+            with deadline(1):
+                assert await fetch_temperature(CITY, "key") == stub.temperature
+                await assert_unavailable(stub.guard, "rate_limited")
+                assert await fetch_temperature(CITY, "key") is None
+            assert stub.requests == 1
+
+    asyncio.run(scenario())
+
+
+def test_deadline_expiry_surfaces_as_unavailable(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard()) as stub:
+            stub.delay = 0.3
+            with deadline(0.1):
+                # The request only gets the time left in the budget
+                assert await fetch_temperature(CITY, "key") is None
+                await assert_unavailable(stub.guard, "deadline")
+            assert stub.requests == 1
+            # Only the deadline was too short for the upstream
+            assert stub.guard.breaker.failures == 0
+
+    asyncio.run(scenario())
+
+
+def test_timeout_with_the_full_time_is_a_failure(monkeypatch):
+    async def scenario():
+        async with WeatherStub(monkeypatch, make_guard(timeout=0.1)) as stub:
+            stub.delay = 0.3
+            assert await fetch_temperature(CITY, "key") is None
+            assert stub.guard.breaker.failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiting_for_a_token_does_not_starve_the_request(monkeypatch):
+    async def scenario():
+        guard = make_guard(rate=1.1, burst=1, min_timeout=0.5)
+        async with WeatherStub(monkeypatch, guard) as stub:
+            stub.delay = 0.15
+            with deadline(1):
+                results = await asyncio.gather(
+                    fetch_temperature(CITY, "key"), fetch_temperature(CITY, "key")
+                )
+            # The second call waited ~0.9s for a token and was not sent
+            assert results == [stub.temperature, None]
+            assert stub.requests == 1
+            assert guard.breaker.failures == 0
+            # Its token was handed back
+            assert guard.bucket.tokens > 0
+
+    asyncio.run(scenario())
+
+
+def test_rejected_probe_releases_the_probe_slot(monkeypatch):
+    async def scenario():
+        guard = make_guard(rate=0.01, burst=1, failures=1, reset_timeout=0)
+        async with WeatherStub(monkeypatch, guard) as stub:
+            stub.status = 500
+            assert await fetch_temperature(CITY, "key") is None
+            assert guard.breaker.is_open
+
+            with deadline(1):
+                await assert_unavailable(guard, "rate_limited")
+            assert not guard.breaker.probing
+            # The next call may probe again
+            assert guard.breaker.allow()
+
+    asyncio.run(scenario())
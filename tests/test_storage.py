@@ -0,0 +1,176 @@
+"""SQLiteStorage must not lose changes when a flush fails, even if the
+profile is evicted and loaded again afterwards."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from models import DailyStats, FoodEntry, UserProfile
+from storage import SQLiteStorage
+
+DAY = "2024-05-01"
+TIMEOUT = 10
+
+
+def make_profile(user_id):
+    profile = UserProfile(user_id=user_id, weight=70, height=180, age=30, activity_minutes=60, city="Moscow")
+    profile.daily_stats[DAY] = DailyStats(DAY, water_goal=2600, calorie_goal=1915, temperature=20)
+    return profile
+
+
+def fail_once(storage, call):
+    """Make the `call`-th executemany of the storage connection raise once."""
+    executemany = storage._db.executemany
+    calls = 0
+
+    async def failing(sql, rows):
+        nonlocal calls
+        calls += 1
+        if calls == call:
+            raise RuntimeError("disk I/O error")
+        return await executemany(sql, rows)
+
+    storage._db.executemany = failing
+
+
+@asynccontextmanager
+async def opened(tmp_path, cache_size=1):
+    storage = SQLiteStorage(tmp_path / "bot.sqlite", flush_interval=3600, cache_size=cache_size)
+    await storage.start()
+    try:
+        yield storage
+    finally:
+        # An open connection thread would keep the test process alive
+        await storage.close()
+
+
+def run(scenario):
+    asyncio.run(asyncio.wait_for(scenario(), TIMEOUT))
+
+
+def test_failed_flush_survives_eviction_and_reload(tmp_path):
+    async def scenario():
+        async with opened(tmp_path) as storage:
+            await storage.put_profile(make_profile(1))
+            await storage.flush()
+
+            profile = await storage.get_profile(1)
+            stats = profile.daily_stats[DAY]
+            stats.logged_water += 500
+            stats.logged_calories += 89
+            await storage.append_food(1, stats, FoodEntry("Banana", 100, 89, 1714550400))
+
+            # The users row is written, then the stats statement fails
+            fail_once(storage, 2)
+            with pytest.raises(RuntimeError):
+                await storage.flush()
+
+            # Loading another user must not evict the one with unwritten changes
+            await storage.put_profile(make_profile(2))
+            assert await storage.get_profile(1) is profile
+
+            await storage.flush()
+            await storage.get_profile(2)
+            assert 1 not in storage._profiles
+
+            reloaded = await storage.get_profile(1)
+            assert reloaded is not profile
+            assert reloaded.daily_stats[DAY].logged_water == 500
+            assert reloaded.daily_stats[DAY].logged_calories == 89
+            assert [entry.name for entry in reloaded.daily_stats[DAY].food_log] == ["Banana"]
+
+    run(scenario)
+
+
+def test_newer_changes_win_over_a_failed_batch(tmp_path):
+    async def scenario():
+        async with opened(tmp_path, cache_size=0) as storage:
+            profile = make_profile(1)
+            await storage.put_profile(profile)
+            fail_once(storage, 1)
+            with pytest.raises(RuntimeError):
+                await storage.flush()
+
+            profile.timezone = "Europe/Moscow"
+            await storage.update_profile(profile)
+            await storage.flush()
+
+        async with opened(tmp_path) as storage:
+            reloaded = await storage.get_profile(1)
+            assert reloaded.timezone == "Europe/Moscow"
+            assert DAY in reloaded.daily_stats
+
+    run(scenario)
+
+
+def test_profile_stays_in_memory_while_its_flush_is_in_flight(tmp_path):
+    async def scenario():
+        async with opened(tmp_path) as storage:
+            for user_id in (1, 2):
+                await storage.put_profile(make_profile(user_id))
+            await storage.flush()
+
+            profile = await storage.get_profile(1)
+            profile.daily_stats[DAY].logged_water += 250
+            await storage.update_counters(1, profile.daily_stats[DAY])
+
+            commit = storage._db.commit
+            writing, release = asyncio.Event(), asyncio.Event()
+
+            async def failing_commit():
+                writing.set()
+                await release.wait()
+                raise RuntimeError("disk I/O error")
+
+            storage._db.commit = failing_commit
+            try:
+                flush = asyncio.create_task(storage.flush())
+                await writing.wait()
+                # Touching another user while the write is pending evicts idle profiles
+                await storage.get_profile(2)
+                assert 1 in storage._profiles
+            finally:
+                release.set()
+                with pytest.raises(RuntimeError):
+                    await flush
+                storage._db.commit = commit
+            assert 1 in storage._profiles
+
+            await storage.flush()
+            await storage.get_profile(2)
+            assert 1 not in storage._profiles
+            reloaded = await storage.get_profile(1)
+            assert reloaded.daily_stats[DAY].logged_water == 250
+
+    run(scenario)
+
+
+def test_reload_keeps_changes_of_an_evicted_profile_still_in_use(tmp_path):
+    async def scenario():
+        async with opened(tmp_path) as storage:
+            for user_id in (1, 2):
+                await storage.put_profile(make_profile(user_id))
+            await storage.flush()
+
+            # A handler holds the profile across an await that evicts it
+            held = await storage.get_profile(1)
+            await storage.get_profile(2)
+            assert 1 not in storage._profiles
+            stats = held.daily_stats[DAY]
+            stats.logged_calories += 89
+            await storage.append_food(1, stats, FoodEntry("Banana", 100, 89, 1714550400))
+
+            # Loaded again before the next flush, then changed once more
+            profile = await storage.get_profile(1)
+            assert profile.daily_stats[DAY].logged_calories == 89
+            profile.daily_stats[DAY].logged_water += 250
+            await storage.update_counters(1, profile.daily_stats[DAY])
+            await storage.flush()
+
+        async with opened(tmp_path) as storage:
+            reloaded = await storage.get_profile(1)
+            assert reloaded.daily_stats[DAY].logged_calories == 89
+            assert reloaded.daily_stats[DAY].logged_water == 250
+            assert [entry.name for entry in reloaded.daily_stats[DAY].food_log] == ["Banana"]
+
+    run(scenario)
@@ -0,0 +1,117 @@
+"""Stand-in for Telegram when running the bot in webhook mode locally.
+
+Start a fake Bot API that accepts every method, point the bot at it and
+run it in webhook mode:
+
+    python tools/webhook_poster.py serve-api --port 8081
+    BOT_MODE=webhook WEBHOOK_BASE_URL=http://localhost:8080 WEBHOOK_SECRET=secret \\
+        TELEGRAM_API_URL=http://localhost:8081 python bot.py
+
+Then post synthetic updates to the webhook:
+
+    python tools/webhook_poster.py post --secret secret --users 50 --count 1000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+
+COMMANDS = [
+    "/start",
+    "/help",
+    "/log_water 250",
+    "/check_progress",
+    "/log_workout run",
+]
+
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+async def post_updates(url, secret, users, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+    update_ids = itertools.count(1)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async def post(session):
+        update = make_update(next(update_ids), random.randint(1, users), random.choice(COMMANDS))
+        async with semaphore:
+            try:
+                async with session.post(url, json=update, headers=headers) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session) for _ in range(count)))
+    elapsed = time.perf_counter() - started
+
+    print(f"Posted {count} updates in {elapsed:.2f}s ({count / elapsed:.0f} updates/s)")
+    for status, number in sorted(statuses.items(), key=str):
+        print(f"  {status}: {number}")
+
+
+async def fake_api(request):
+    method = request.match_info["method"].lower()
+    if method.startswith("send"):
+        data = await request.post()
+        chat_id = int(data.get("chat_id", 0))
+        result = {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+    elif method == "getme":
+        result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def serve_api(host, port):
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake_api)
+    web.run_app(app, host=host, port=port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    post = subparsers.add_parser("post", help="post synthetic updates to the webhook")
+    post.add_argument("--url", default="http://localhost:8080/webhook")
+    post.add_argument("--secret", default=None)
+    post.add_argument("--users", type=int, default=10)
+    post.add_argument("--count", type=int, default=100)
+    post.add_argument("--concurrency", type=int, default=20)
+
+    serve = subparsers.add_parser("serve-api", help="run a fake Telegram Bot API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+
+    args = parser.parse_args()
+    if args.command == "post":
+        asyncio.run(post_updates(args.url, args.secret, args.users, args.count, args.concurrency))
+    else:
+        serve_api(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
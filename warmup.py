@@ -0,0 +1,34 @@
+import asyncio
+import importlib
+import time
+
+from logger import logger
+
+# Heavy modules that are imported lazily by the commands that need them
+WARMUP_MODULES = (
+    "numpy",
+)
+
+_warmup_task = None
+
+
+def _import_modules(modules):
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.error("Warm-up import of {} failed: {}", name, e)
+            continue
+        logger.debug("Warmed up {} in {:.0f} ms", name, (time.perf_counter() - started) * 1000)
+
+
+def start_warmup(modules=WARMUP_MODULES):
+    """Import `modules` in a worker thread once the bot is serving updates.
+
+    The first command that needs one of them then finds it in sys.modules
+    instead of paying for the import on the event loop.
+    """
+    global _warmup_task
+    _warmup_task = asyncio.create_task(asyncio.to_thread(_import_modules, modules))
+    return _warmup_task
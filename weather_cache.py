@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+def normalize_city(city):
+    return " ".join(str(city).split()).casefold()
+
+
+class WeatherCache:
+    """In-process TTL/LRU cache of temperatures keyed by normalized city.
+
+    Concurrent lookups for the same city share a single in-flight request.
+    """
+
+    def __init__(self, ttl=600, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get_stale(self, key):
+        """Last stored value for `key`, even if it has expired.
+
+        Expired entries stay in the cache until the LRU bound evicts them so
+        that they can serve as a fallback while the upstream is down.
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_fetch(self, key, fetch):
+        """Return the cached temperature for `key` or await `fetch()` once.
+
+        Failed lookups (None) are not cached so the next call retries.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not reported by asyncio
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,94 @@
+import asyncio
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEB_SERVER_HOST, WEB_SERVER_PORT,
+    WEBHOOK_DRAIN_TIMEOUT,
+)
+from logger import logger
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Webhook handler that finishes in-flight updates before shutting down.
+
+    Updates are processed in background tasks so Telegram gets an immediate
+    response; on shutdown new requests are refused with 503 and the running
+    tasks are awaited for up to `drain_timeout` seconds.
+    """
+
+    def __init__(self, *args, drain_timeout=WEBHOOK_DRAIN_TIMEOUT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+        self.draining = False
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def handle(self, request):
+        if self.draining:
+            return web.Response(status=503, text="Shutting down")
+        return await super().handle(request)
+
+    async def drain(self, *args, **kwargs):
+        self.draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info("Draining {} in-flight updates", len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if pending:
+            logger.error("{} updates did not finish within {}s", len(pending), self.drain_timeout)
+
+
+def create_app(dp, bot):
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET)
+
+    async def health(request):
+        if handler.draining:
+            return web.json_response({"status": "draining"}, status=503)
+        return web.json_response({"status": "ok", "in_flight": handler.in_flight})
+
+    app.router.add_get("/health", health)
+
+    # aiohttp runs shutdown callbacks in registration order: drain updates
+    # first, then the Dispatcher shutdown hooks, then close the bot session.
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=WEBHOOK_PATH)
+    return app
+
+
+async def set_webhook(bot):
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=["message"],
+    )
+
+
+async def run_webhook(dp, bot):
+    dp.startup.register(set_webhook)
+    runner = web.AppRunner(create_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
+    await site.start()
+    logger.info("Webhook server listening on {}:{}", WEB_SERVER_HOST, WEB_SERVER_PORT)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook server")
+        await runner.cleanup()